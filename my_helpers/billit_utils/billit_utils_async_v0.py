@@ -0,0 +1,177 @@
+# billit_utils_async_v0.py
+# asyncio version of the Billit read calls, for reconciliation jobs that fetch many orders / files
+# created 20261017
+# requires aiohttp (pip install my-helpers[async])
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from my_helpers.exceptions.exceptions_v0 import ExternalAPIError
+
+
+# --- Rate limiting ---
+# Requests are spaced evenly so that at most `rate` requests start per `per` seconds,
+# on top of that a 429 from Billit is retried after its Retry-After delay.
+class AsyncRateLimiter:
+    """At most `rate` requests per `per` seconds, evenly spaced."""
+
+    def __init__(self, rate, per=1.0):
+        self.interval = per / rate
+        self._next_slot = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncBillitClient:
+    """
+    asyncio Billit API client on aiohttp, use it as an async context manager.
+
+    :param api_key: str - Billit API key
+    :param base_url: str - Base URL of the Billit API (e.g. https://api.billit.be)
+    :param concurrency: maximum number of open connections / requests in flight to Billit
+    :param rate_limit: maximum number of requests per second (None for no limit)
+    :param timeout: total timeout per request in seconds
+    :param max_retries: how often a request that got 429 Too Many Requests is retried
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url,
+        concurrency=8,
+        rate_limit=10,
+        timeout=60,
+        max_retries=3,
+    ):
+        if not base_url or not api_key:
+            raise ValueError("Billit API base URL or API Key not configured.")
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = AsyncRateLimiter(rate_limit) if rate_limit else None
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"ApiKey": self.api_key, "Accept": "application/json"},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def api_call(self, method, endpoint, params=None, data=None):
+        """
+        Makes an authenticated call to the Billit API, returns the JSON response.
+        Raises ExternalAPIError for non-2xx responses.
+        """
+        url = f"{self.base_url}{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                await self.rate_limiter.wait()
+            async with self.session.request(
+                method, url, params=params, json=data
+            ) as response:
+                if response.status == 429 and attempt < self.max_retries:
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", 2**attempt))
+                    except ValueError:
+                        retry_after = 2**attempt  # an HTTP date, back off instead
+                    logging.warning(
+                        f"Billit rate limit hit on {method} {url}, retrying in {retry_after}s"
+                    )
+                    await asyncio.sleep(retry_after)
+                    continue
+                if response.status >= 400:
+                    text = await response.text()
+                    logging.error(f"Billit API call failed: {method} {url} - {response.status}")
+                    logging.error(f"Billit API Error Response: {text}")
+                    raise ExternalAPIError(
+                        f"Billit API call failed: {method} {url}. Status: {response.status}, Response: {text}"
+                    )
+                return await response.json(content_type=None)
+
+    async def get_order_details(self, order_id):
+        """Fetches full order details from Billit API."""
+        logging.info(f"Fetching order details for ID: {order_id}")
+        return await self.api_call("GET", f"/v1/orders/{order_id}")
+
+    async def get_file_content(self, file_id):
+        """Fetches file content (base64) from Billit API."""
+        logging.info(f"Fetching file content for FileID: {file_id}")
+        return await self.api_call("GET", f"/v1/files/{file_id}")
+
+    async def _gather(self, fetch, ids, concurrency, return_exceptions):
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def fetch_one(item_id):
+            async with semaphore:
+                return await fetch(item_id)
+
+        return await asyncio.gather(
+            *(fetch_one(item_id) for item_id in ids),
+            return_exceptions=return_exceptions,
+        )
+
+    async def gather_orders(self, order_ids, concurrency=None, return_exceptions=False):
+        """
+        Fetches the details of many orders concurrently.
+
+        :param order_ids: list of Billit order ids
+        :param concurrency: requests in flight, defaults to the client's concurrency
+        :param return_exceptions: put the exception in the result for failed orders
+                                  instead of raising the first one
+        :return: list of order details, in the order of order_ids
+        """
+        return await self._gather(
+            self.get_order_details, order_ids, concurrency, return_exceptions
+        )
+
+    async def gather_files(self, file_ids, concurrency=None, return_exceptions=False):
+        """Fetches the content of many files concurrently, see gather_orders."""
+        return await self._gather(
+            self.get_file_content, file_ids, concurrency, return_exceptions
+        )
+
+
+# --- Synchronous entry points for scripts and batch jobs ---
+def gather_billit_orders(
+    order_ids, BILLIT_API_KEY, BILLIT_BASE_URL, concurrency=8, rate_limit=10
+):
+    """Fetches many Billit orders concurrently from synchronous code."""
+
+    async def run():
+        async with AsyncBillitClient(
+            BILLIT_API_KEY, BILLIT_BASE_URL, concurrency, rate_limit
+        ) as client:
+            return await client.gather_orders(order_ids)
+
+    return asyncio.run(run())
+
+
+def gather_billit_files(
+    file_ids, BILLIT_API_KEY, BILLIT_BASE_URL, concurrency=8, rate_limit=10
+):
+    """Fetches many Billit files concurrently from synchronous code."""
+
+    async def run():
+        async with AsyncBillitClient(
+            BILLIT_API_KEY, BILLIT_BASE_URL, concurrency, rate_limit
+        ) as client:
+            return await client.gather_files(file_ids)
+
+    return asyncio.run(run())
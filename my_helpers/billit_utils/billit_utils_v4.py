@@ -0,0 +1,1592 @@
+# billit_utils_v4.py
+# Improved version with better error handling and logging
+# created by Marc De Krock
+# date: 2025-08-22
+# 2025-09-16 : added wait and retry logic to fetch order with pdf
+# 20251117: made retries, delay and interval now configurable in fetch_order_with_pdf
+# last edited: 20261017: all calls go through a BillitClient with a pooled keep-alive requests.Session,
+#                        the module-level functions are thin wrappers over a shared client per API key
+# 20261017: fetch_order_with_pdf polls with exponential backoff, jitter and a deadline, the first
+#           poll is timed on recent PDF render times and polls skip JSON decoding until the PDF is there
+# 20261017: added PdfReadinessPoller / watch_order_pdf, waiting for PDFs without blocking a worker per order
+# 20261017: added download_file / download_billit_file, streaming base64 decode of FileContent to a
+#           file path, file-like object or bytearray
+# 20261017: added BillitCache / enable_billit_cache, order details (TTL) and files (by FileID) are cached
+#           in memory and optionally on disk, an order is invalidated when it is sent
+# 20261017: added send_orders, sends many orders per API call with a result per order
+# 20261017: every call goes through BillitClient._request: connect / read timeouts, GETs retried with
+#           backoff, POSTs carry an Idempotency-Key and are only retried when Billit did not get them,
+#           and a circuit breaker fails fast (BillitUnavailable) while Billit is down
+# 20261017: added iter_orders (paginated order listing, next page fetched ahead) and sync_orders with
+#           a high-water mark on LastModified persisted in a cursor file
+# 20261017: added BillitOrder / BillitOrderLine, compact views over the raw order JSON that parse
+#           fields on access and only decode the embedded PDF when asked for
+
+from flask import jsonify
+import requests
+import binascii
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from my_helpers.exceptions.exceptions_v0 import (
+    ExternalAPIError,
+    MethodNotAllowedError,
+    BadRequestError,
+    BusinessRuleError,
+    BillitOrderNotFound,
+    BillitOrderPDFTimeout,
+    BillitUnavailable,
+)
+
+BILLIT_TRANSPORT_TYPES = [
+    "SMTP",
+    "Letter",
+    "Peppol",
+    "SDI",
+    "KSeF",
+    "OSA",
+    "ANAF",
+    "SAT",
+]
+
+
+# --- Waiting for the order PDF ---
+# Billit renders the PDF some seconds after an order is sent. PdfWaitEstimator keeps the
+# most recent render times, so the first poll happens around the time the PDF is usually
+# ready instead of after a fixed delay.
+class PdfWaitEstimator:
+    """
+    Learns how long Billit takes to render an order PDF.
+
+    :param default_delay: first-poll delay until render times have been observed
+    :param min_delay: lower bound of the learned delay
+    :param max_delay: upper bound of the learned delay
+    :param samples: number of recent render times to keep
+    """
+
+    def __init__(self, default_delay=5, min_delay=0.5, max_delay=15, samples=20):
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._samples = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def initial_delay(self):
+        """Median of the recent render times, within [min_delay, max_delay]."""
+        with self._lock:
+            if not self._samples:
+                return self.default_delay
+            samples = sorted(self._samples)
+        median = samples[len(samples) // 2]
+        return min(max(median, self.min_delay), self.max_delay)
+
+    def record(self, first_seen, last_missed=None):
+        """
+        Records one render: first_seen is the elapsed time of the poll that found the PDF,
+        last_missed the elapsed time of the poll before it (None when the first poll found it).
+        """
+        if last_missed is None:
+            # already there at the first poll: the real time was shorter, probe lower next time
+            estimate = first_seen * 0.75
+        else:
+            estimate = (first_seen + last_missed) / 2
+        with self._lock:
+            self._samples.append(estimate)
+
+
+# --- Streaming file download ---
+# A Billit file is a JSON object with the PDF as base64 string in FileContent. Instead of
+# response.json() (body + str + decoded bytes + BytesIO copy in memory) the response is
+# streamed and FileContent is decoded chunk by chunk straight into the destination.
+# FileContent up to the opening quote of its value, a null FileContent does not match
+_FILE_CONTENT_VALUE = re.compile(rb'"FileContent"\s*:\s*"')
+
+
+def _decode_file_content(chunks, write):
+    """
+    Decodes the FileContent field of a streamed Billit file response.
+
+    :param chunks: iterable of bytes, the raw JSON response
+    :param write: called with every decoded piece of the file
+    :return: tuple (file JSON without FileContent, number of bytes written)
+    """
+    head = b""  # JSON before and including the opening quote of FileContent
+    tail = []  # JSON after the closing quote, the remaining (small) fields
+    carry = b""  # base64 characters not yet decoded (not a multiple of 4)
+    state = "head"
+    size = 0
+
+    for chunk in chunks:
+        if state == "head":
+            head += chunk
+            match = _FILE_CONTENT_VALUE.search(head)
+            if match is None:
+                continue
+            chunk = head[match.end() :]
+            head = head[: match.end()]
+            state = "content"
+        if state == "content":
+            end = chunk.find(b'"')
+            if end >= 0:
+                tail.append(chunk[end:])
+                chunk = chunk[:end]
+                state = "tail"
+            # JSON may escape "/" as "\/", base64 has no other characters that need escaping
+            data = carry + chunk.replace(b"\\", b"")
+            usable = len(data) - len(data) % 4 if state == "content" else len(data)
+            carry = data[usable:]
+            if usable:
+                decoded = binascii.a2b_base64(data[:usable])
+                write(decoded)
+                size += len(decoded)
+        elif state == "tail":
+            tail.append(chunk)
+
+    if state == "head":
+        file_json = json.loads(head or b"null")
+        raise ExternalAPIError(f"No FileContent in Billit file response: {file_json}")
+    if state == "content":
+        raise ExternalAPIError("Billit file response ended inside FileContent")
+    file_json = json.loads(head + b"".join(tail))
+    del file_json["FileContent"]
+    return file_json, size
+
+
+# --- Cache for orders and files ---
+# The same order and file are typically fetched several times (PDF, email, archive to Drive).
+# File content never changes so files are kept by FileID without expiry, order details
+# change (status, PDF, payments) so they expire after order_ttl and are invalidated by send_order.
+class BillitCache:
+    """
+    LRU cache in memory with an optional tier on disk for Billit orders and files.
+
+    :param max_items: maximum number of orders + files kept in memory
+    :param order_ttl: seconds an order is served from the cache
+    :param disk_dir: directory for the disk tier (None for memory only), the disk tier is not pruned
+    """
+
+    def __init__(self, max_items=256, order_ttl=300, disk_dir=None):
+        self.max_items = max_items
+        self.order_ttl = order_ttl
+        self.disk_dir = disk_dir
+        self._items = OrderedDict()  # (kind, key) -> (expires or None, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, kind, key):
+        digest = hashlib.sha256(f"{kind}:{key}".encode()).hexdigest()
+        return os.path.join(self.disk_dir, f"{kind}-{digest}.json")
+
+    def get(self, kind, key):
+        """Returns a copy of the cached value, or None."""
+        item_key = (kind, str(key))
+        with self._lock:
+            item = self._items.get(item_key)
+            if item is not None:
+                self._items.move_to_end(item_key)
+        if item is None and self.disk_dir:
+            item = self._read_disk(kind, key)
+            if item is not None:
+                self._remember(item_key, item)
+        if item is None or (item[0] is not None and item[0] < time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # callers (e.g. the in-place cleaners) may change the result, the cached value stays intact
+        return copy.deepcopy(item[1])
+
+    def put(self, kind, key, value, ttl=None):
+        item = (None if ttl is None else time.time() + ttl, copy.deepcopy(value))
+        self._remember((kind, str(key)), item)
+        if self.disk_dir:
+            self._write_disk(kind, key, {"expires": item[0], "value": value})
+
+    def invalidate(self, kind, key):
+        with self._lock:
+            self._items.pop((kind, str(key)), None)
+        if self.disk_dir:
+            try:
+                os.remove(self._path(kind, key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def _remember(self, item_key, item):
+        with self._lock:
+            self._items[item_key] = item
+            self._items.move_to_end(item_key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def _write_disk(self, kind, key, stored):
+        # a temp file per writer: threads / processes writing the same key do not share it
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".part")
+            with os.fdopen(fd, "w") as f:
+                json.dump(stored, f)
+            os.replace(temp_path, self._path(kind, key))
+        except OSError as e:
+            # the disk tier is best effort, the value is cached in memory
+            logging.warning(f"Billit cache could not write {kind} {key} to disk: {e}")
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def _read_disk(self, kind, key):
+        try:
+            with open(self._path(kind, key)) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return stored["expires"], stored["value"]
+
+    # orders and files
+    def get_order(self, order_id):
+        return self.get("order", order_id)
+
+    def put_order(self, order_id, order_details):
+        self.put("order", order_id, order_details, ttl=self.order_ttl)
+
+    def invalidate_order(self, order_id):
+        self.invalidate("order", order_id)
+
+    def get_file(self, file_id):
+        return self.get("file", file_id)
+
+    def put_file(self, file_id, file_json):
+        self.put("file", file_id, file_json)
+
+
+# --- Transport: timeouts, retries and circuit breaker ---
+# After failure_threshold consecutive failures (connection errors, timeouts, 5xx) the breaker
+# opens and calls fail immediately with BillitUnavailable instead of tying up a worker until
+# the timeout. After reset_timeout one trial call is let through, its outcome closes the
+# breaker again or keeps it open.
+class CircuitBreaker:
+    """
+    :param failure_threshold: consecutive failures that open the breaker
+    :param reset_timeout: seconds the breaker stays open before a trial call
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises BillitUnavailable when the call may not go through."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            open_for = time.monotonic() - self.opened_at
+            if open_for >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True  # half-open: this call is the trial
+                return
+        raise BillitUnavailable(
+            f"Billit circuit breaker open after {self.failures} consecutive failures, retrying after {self.reset_timeout}s"
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.error(f"Billit circuit breaker opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+BILLIT_RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def _request_not_sent(e):
+    """True when the request provably never reached Billit (safe to retry a POST)."""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+# --- Incremental order sync ---
+class OrderSyncCursor:
+    """
+    High-water mark for incremental order sync: the highest LastModified seen, kept in a JSON file.
+
+    :param path: file that holds the cursor
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Returns the stored LastModified, or None before the first sync."""
+        try:
+            with open(self.path) as f:
+                return json.load(f).get("modified_since")
+        except FileNotFoundError:
+            return None
+
+    def save(self, modified_since):
+        with open(f"{self.path}.part", "w") as f:
+            json.dump({"modified_since": modified_since}, f)
+        os.replace(f"{self.path}.part", self.path)
+
+
+def _modified_since_filter(modified_since):
+    if isinstance(modified_since, datetime):
+        modified_since = modified_since.strftime("%Y-%m-%dT%H:%M:%S")
+    return f"LastModified ge DateTime'{modified_since}'"
+
+
+# --- Order models ---
+# A parsed order is a tree of dicts and strings that takes several times the size of its JSON,
+# including the base64 PDF when it is embedded. BillitOrder keeps the raw JSON bytes and parses
+# on access: the common fields once (kept in a tuple), everything else on every call.
+# The PDF content is skipped when parsing and only decoded by pdf / pdf_bytes.
+# The attributes are generated from BILLIT_ORDER_ATTRIBUTES / BILLIT_ORDER_LINE_ATTRIBUTES.
+# (attribute, Billit field)
+BILLIT_ORDER_ATTRIBUTES = (
+    ("order_id", "OrderID"),
+    ("order_number", "OrderNumber"),
+    ("order_type", "OrderType"),
+    ("order_direction", "OrderDirection"),
+    ("order_status", "OrderStatus"),
+    ("order_date", "OrderDate"),
+    ("expiry_date", "ExpiryDate"),
+    ("currency", "Currency"),
+    ("total_excl", "TotalExcl"),
+    ("total_vat", "TotalVAT"),
+    ("total_incl", "TotalIncl"),
+    ("paid", "Paid"),
+    ("last_modified", "LastModified"),
+)
+BILLIT_ORDER_LINE_ATTRIBUTES = (
+    ("order_line_id", "OrderLineID"),
+    ("description", "Description"),
+    ("quantity", "Quantity"),
+    ("unit_price_excl", "UnitPriceExcl"),
+    ("vat_percentage", "VATPercentage"),
+    ("total_excl", "TotalExcl"),
+    ("total_vat", "TotalVAT"),
+    ("total_incl", "TotalIncl"),
+)
+BILLIT_ORDER_FIELDS = tuple(field for _, field in BILLIT_ORDER_ATTRIBUTES)
+BILLIT_ORDER_LINE_FIELDS = tuple(field for _, field in BILLIT_ORDER_LINE_ATTRIBUTES)
+_MISSING_FIELD = object()
+
+
+_ORDER_PDF_OBJECT = re.compile(rb'"OrderPDF"\s*:\s*\{')
+_JSON_STRING_OR_BRACE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]')
+_JSON_COLON = re.compile(rb"\s*:")
+
+
+def _file_content_span(raw):
+    """
+    (start, end) of the FileContent string value of OrderPDF in raw JSON bytes, without the quotes.
+    None when OrderPDF has no FileContent string, FileContent of other objects (attachments) is skipped.
+    """
+    match = _ORDER_PDF_OBJECT.search(raw)
+    if match is None:
+        return None
+    depth = 1
+    position = match.end()
+    while depth:
+        token = _JSON_STRING_OR_BRACE.search(raw, position)
+        if token is None:
+            return None
+        position = token.end()
+        if token.group() == b"{":
+            depth += 1
+        elif token.group() == b"}":
+            depth -= 1
+        elif token.group() == b'"FileContent"' and depth == 1 and _JSON_COLON.match(raw, position):
+            value = _FILE_CONTENT_VALUE.match(raw, token.start())
+            if value is None:
+                return None  # FileContent is not a string (null)
+            start = value.end()
+            return start, raw.find(b'"', start)
+    return None
+
+
+def _field_property(index, doc):
+    def field(self):
+        value = self._load_fields()[index]
+        return None if value is _MISSING_FIELD else value
+
+    return property(field, doc=doc)
+
+
+class BillitOrderLine:
+    """Compact view of one order line, the common fields as attributes, others via get()."""
+
+    __slots__ = ("_fields", "_extra")
+
+    def __init__(self, line):
+        # _MISSING_FIELD for absent fields, a field present with value null stays None
+        self._fields = tuple(line.get(name, _MISSING_FIELD) for name in BILLIT_ORDER_LINE_FIELDS)
+        extra = {k: v for k, v in line.items() if k not in BILLIT_ORDER_LINE_FIELDS}
+        self._extra = extra or None
+
+    def _load_fields(self):
+        return self._fields
+
+    def get(self, key, default=None):
+        if key in BILLIT_ORDER_LINE_FIELDS:
+            value = self._fields[BILLIT_ORDER_LINE_FIELDS.index(key)]
+            return default if value is _MISSING_FIELD else value
+        return (self._extra or {}).get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING_FIELD)
+        if value is _MISSING_FIELD:
+            raise KeyError(key)
+        return value
+
+    def to_dict(self):
+        line = {
+            k: v for k, v in zip(BILLIT_ORDER_LINE_FIELDS, self._fields) if v is not _MISSING_FIELD
+        }
+        line.update(self._extra or {})
+        return line
+
+    def __repr__(self):
+        return f"BillitOrderLine({self.description!r}, {self.quantity!r} x {self.unit_price_excl!r})"
+
+
+class BillitOrder:
+    """
+    Compact view of a Billit order over its raw JSON bytes.
+
+    The common fields (BILLIT_ORDER_FIELDS) are attributes, parsed once on first access.
+    Other fields via order["Field"] / order.get("Field"), lines via order.lines, both parsed on
+    every call so nothing but the bytes stays in memory. The embedded PDF is only decoded by
+    pdf / pdf_bytes().
+
+    :param raw: bytes - the order JSON as returned by GET /v1/orders/{id}
+    """
+
+    __slots__ = ("_raw", "_pdf_span", "_fields")
+
+    def __init__(self, raw):
+        self._raw = bytes(raw)
+        self._pdf_span = _file_content_span(self._raw)
+        self._fields = None
+
+    @classmethod
+    def from_dict(cls, order):
+        return cls(json.dumps(order, separators=(",", ":")).encode())
+
+    def _parse(self):
+        """The order as dict, FileContent of the PDF left empty."""
+        raw = self._raw
+        if self._pdf_span:
+            start, end = self._pdf_span
+            raw = raw[:start] + raw[end:]
+        return json.loads(raw)
+
+    def _load_fields(self):
+        if self._fields is None:
+            order = self._parse()
+            # _MISSING_FIELD for absent fields, a field present with value null stays None
+            self._fields = tuple(order.get(name, _MISSING_FIELD) for name in BILLIT_ORDER_FIELDS)
+        return self._fields
+
+    def get(self, key, default=None):
+        if key in BILLIT_ORDER_FIELDS:
+            value = self._load_fields()[BILLIT_ORDER_FIELDS.index(key)]
+            return default if value is _MISSING_FIELD else value
+        if key == "OrderPDF":
+            return self.pdf if self._pdf_span else self._parse().get(key, default)
+        return self._parse().get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING_FIELD)
+        if value is _MISSING_FIELD:
+            raise KeyError(key)
+        return value
+
+    @property
+    def lines(self):
+        """list of BillitOrderLine, parsed on every access."""
+        return [BillitOrderLine(line) for line in self._parse().get("OrderLines") or []]
+
+    @property
+    def has_pdf(self):
+        return self._pdf_span is not None or b'"OrderPDF"' in self._raw
+
+    @property
+    def pdf(self):
+        """OrderPDF dict including the base64 FileContent, or None."""
+        return json.loads(self._raw).get("OrderPDF")
+
+    def pdf_bytes(self):
+        """Decoded PDF straight from the raw bytes, or None when the content is not embedded."""
+        if not self._pdf_span:
+            return None
+        start, end = self._pdf_span
+        return binascii.a2b_base64(self._raw[start:end].replace(b"\\", b""))
+
+    def to_dict(self):
+        return json.loads(self._raw)
+
+    def __repr__(self):
+        return f"BillitOrder({self.order_id!r}, {self.order_number!r})"
+
+
+for _index, (_attribute, _field) in enumerate(BILLIT_ORDER_ATTRIBUTES):
+    setattr(BillitOrder, _attribute, _field_property(_index, _field))
+for _index, (_attribute, _field) in enumerate(BILLIT_ORDER_LINE_ATTRIBUTES):
+    setattr(BillitOrderLine, _attribute, _field_property(_index, _field))
+
+
+# --- Billit client ---
+# One requests.Session per client: the TCP + TLS connection to Billit is opened once
+# and reused by every call (post, send, the polling in fetch_order_with_pdf, ...)
+class BillitClient:
+    """
+    Billit API client holding a pooled, keep-alive requests.Session.
+
+    :param api_key: str - Billit API key
+    :param base_url: str - Base URL of the Billit API (e.g. https://api.billit.be),
+                           needed for the calls that do not get a full URL
+    :param pool_connections: number of hosts to keep a connection pool for
+    :param pool_maxsize: connections kept alive per host (one per concurrent caller)
+    :param connect_timeout: seconds to wait for a connection to Billit
+    :param read_timeout: seconds to wait for Billit's response
+    :param max_retries: retries of a failed GET (and of a POST that did not reach Billit)
+    :param retry_backoff: first wait between retries in seconds, doubled on every retry
+    :param failure_threshold: consecutive failures after which calls fail fast, see CircuitBreaker
+    :param reset_timeout: seconds calls fail fast before Billit is tried again
+    :param session: requests.Session to use instead of a new one (shared with other clients)
+    :param circuit_breaker: CircuitBreaker to use instead of a new one (shared with other clients)
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url=None,
+        pool_connections=4,
+        pool_maxsize=16,
+        connect_timeout=5,
+        read_timeout=60,
+        max_retries=3,
+        retry_backoff=0.5,
+        failure_threshold=5,
+        reset_timeout=30,
+        session=None,
+        circuit_breaker=None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/") if base_url else base_url
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_connections, pool_maxsize=pool_maxsize
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Connection": "keep-alive"})
+        self.session = session
+        self.pdf_wait = PdfWaitEstimator()
+        self.cache = None  # BillitCache, see enable_billit_cache
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(failure_threshold, reset_timeout)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _url(self, url, path):
+        if url:
+            return url
+        if not self.base_url:
+            raise ValueError("Billit API base URL not configured.")
+        return f"{self.base_url}{path}"
+
+    def _headers(self, content_type="application/json", accept="application/json"):
+        return {
+            "Content-Type": content_type,
+            "Accept": accept,
+            "apiKey": self.api_key,
+            "User-Agent": "PostmanRuntime/7.44.1",
+            "Accept-Encoding": "gzip, deflate, br",
+        }
+
+    def _request(self, method, url, headers=None, **kwargs):
+        """
+        Sends one logical request to Billit, all calls of the client go through here.
+        - timeout: (connect, read) of the client on every attempt
+        - GET: retried with exponential backoff on connection errors, timeouts, 429 and 502/503/504
+        - POST: carries an Idempotency-Key (the same on every attempt) and is only retried
+          when it never reached Billit (connection refused / connect timeout) or got 429,
+          so an order is never created or sent twice
+        - Retry-After: waited for up to the read timeout, a longer one returns the response as is
+        - circuit breaker: raises BillitUnavailable without calling Billit while it is open
+        """
+        idempotent = method in ("GET", "HEAD", "OPTIONS")
+        headers = dict(headers or {})
+        if not idempotent:
+            headers.setdefault("Idempotency-Key", uuid.uuid4().hex)
+
+        for attempt in range(self.max_retries + 1):
+            self.circuit_breaker.before_call()
+            wait = self.retry_backoff * 2**attempt
+            try:
+                response = self.session.request(
+                    method, url, headers=headers, timeout=self.timeout, **kwargs
+                )
+            except requests.exceptions.RequestException as e:
+                self.circuit_breaker.record_failure()
+                if attempt == self.max_retries or not (idempotent or _request_not_sent(e)):
+                    raise
+                print(f"Billit {method} {url} failed ({e}), retry {attempt + 1} in {wait:.1f}s")
+                time.sleep(wait)
+                continue
+
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+            retry = response.status_code in BILLIT_RETRY_STATUSES and (
+                idempotent or response.status_code == 429
+            )
+            if not retry or attempt == self.max_retries:
+                return response
+            try:
+                retry_after = max(float(response.headers["Retry-After"]), 0)
+            except (KeyError, ValueError):
+                retry_after = None  # no header, or an HTTP date: exponential backoff
+            if retry_after is not None and retry_after > self.timeout[1]:
+                # sleeping longer than a read timeout would tie up the worker, the caller gets the answer
+                print(
+                    f"Billit {method} {url} returned {response.status_code} with Retry-After {retry_after:.0f}s, not retried"
+                )
+                return response
+            if retry_after is not None:
+                wait = retry_after
+            print(
+                f"Billit {method} {url} returned {response.status_code}, retry {attempt + 1} in {wait:.1f}s"
+            )
+            response.close()
+            time.sleep(wait)
+
+    # Function to post an order to Billit
+    # please note that this only posts the order to Billit, next the order needs to be sent
+    def post_order(self, payload, orders_url=None):
+        """Posts an order to Billit, returns the new Billit order id (int)."""
+        print("Sending order to Billit:", json.dumps(payload, indent=2))
+        url = self._url(orders_url, "/v1/orders")
+        headers = self._headers(content_type="text/json", accept="*/*")
+
+        response = self._request("POST", url, headers=headers, json=payload)
+        response_status = response.status_code
+        if response.status_code == 200:
+            print("Order posted successfully:", response.json())
+        else:
+            print("Failed to post order to Billit:", response_status)
+            raise ExternalAPIError(
+                f"Failed to send order to Billit: {response.status_code}, Response: {response.text}"
+            )
+        return int(response.json())
+
+    def send_order(self, order_id, transport_type, send_url=None):
+        """
+        Sends an order to Billit using the provided order ID and method of transport.
+
+        :param order_id: str - The ID of the order to send
+        :param transport_type: str - The method of transport for the order
+        :return: Response status code from the Billit API
+        """
+        print(f"Sending order {order_id} with transport type {transport_type} to Billit")
+        if transport_type not in BILLIT_TRANSPORT_TYPES:
+            print(f"error: Invalid transport type: {transport_type}")
+            raise ValueError(f"error: Invalid transport type: {transport_type}", 403)
+
+        response = self._post_send_command([order_id], transport_type, send_url)
+        response_status = response.status_code
+        print("Response status code:", response_status)
+
+        if response_status == 200:
+            print("Order sent successfully:", response_status)
+            if self.cache is not None:
+                self.cache.invalidate_order(order_id)
+            return response_status
+        else:
+            print("Failed to transport order to Billit:", response_status)
+            raise ExternalAPIError(
+                f"Failed to transport order to Billit: {response.status_code}, Response: {response.text}"
+            )
+
+    def _post_send_command(self, order_ids, transport_type, send_url=None):
+        url = self._url(send_url, "/v1/orders/commands/send")
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "apiKey": self.api_key,
+        }
+
+        payload = {
+            "Transporttype": transport_type,
+            "OrderIDs": list(order_ids),
+        }
+        print("Payload for sending order:", json.dumps(payload, indent=2))
+        return self._request("POST", url, headers=headers, json=payload)
+
+    def send_orders(self, order_ids, transport_type, chunk_size=50, send_url=None):
+        """
+        Sends many orders to Billit, chunk_size order IDs per API call.
+        When Billit rejects a chunk (4xx other than 429), it is split in two and both halves
+        are sent again, down to single orders, so one bad order does not fail the others.
+        A chunk that may have reached Billit (timeout or connection lost after sending, 5xx)
+        is never sent again: Billit may already have sent those orders to the customer.
+
+        :param order_ids: list - The IDs of the orders to send
+        :param transport_type: str - The method of transport for the orders
+        :param chunk_size: int - maximum number of order IDs per API call
+        :return: dict - order_id -> {"status": "sent" | "failed" | "unknown", "success": bool,
+                        "status_code": int or None, "error": str or None}
+                 "unknown": check in Billit whether the order was sent before sending it again
+        """
+        print(f"Sending {len(order_ids)} orders with transport type {transport_type} to Billit")
+        if transport_type not in BILLIT_TRANSPORT_TYPES:
+            print(f"error: Invalid transport type: {transport_type}")
+            raise ValueError(f"error: Invalid transport type: {transport_type}", 403)
+
+        results = {}
+
+        def record(chunk, status, status_code, error):
+            for order_id in chunk:
+                results[order_id] = {
+                    "status": status,
+                    "success": status == "sent",
+                    "status_code": status_code,
+                    "error": error,
+                }
+
+        pending = [
+            list(order_ids[i : i + chunk_size])
+            for i in range(0, len(order_ids), chunk_size)
+        ]
+        while pending:
+            chunk = pending.pop(0)
+            try:
+                response = self._post_send_command(chunk, transport_type, send_url)
+            except BillitUnavailable as e:
+                # circuit open, nothing was sent and splitting would not help
+                record(chunk, "failed", None, str(e))
+                continue
+            except requests.exceptions.RequestException as e:
+                status = "failed" if _request_not_sent(e) else "unknown"
+                print(f"Sending {len(chunk)} orders to Billit ended with {status}: {e}")
+                record(chunk, status, None, str(e))
+                continue
+
+            status_code = response.status_code
+            if status_code == 200:
+                record(chunk, "sent", 200, None)
+                if self.cache is not None:
+                    for order_id in chunk:
+                        self.cache.invalidate_order(order_id)
+            elif 400 <= status_code < 500 and status_code != 429 and len(chunk) > 1:
+                # rejected, nothing was sent: find the bad orders by splitting
+                print(f"Billit rejected {len(chunk)} orders ({status_code}), splitting the chunk")
+                middle = len(chunk) // 2
+                pending[:0] = [chunk[:middle], chunk[middle:]]
+            elif status_code < 500:
+                print(f"Failed to transport orders {chunk} to Billit: {status_code}")
+                record(chunk, "failed", status_code, response.text)
+            else:
+                print(f"Billit answered {status_code} for orders {chunk}, outcome unknown")
+                record(chunk, "unknown", status_code, response.text)
+
+        counts = Counter(result["status"] for result in results.values())
+        print(
+            f"Orders sent: {counts['sent']}, failed: {counts['failed']}, unknown: {counts['unknown']}"
+        )
+        return results
+
+    def get_order(self, order_id, orders_url=None):
+        """
+        Fetches an order from the Billit API based on order_id.
+
+        Returns:
+            tuple: (order JSON, status code)
+        """
+        if self.cache is not None:
+            order_json = self.cache.get_order(order_id)
+            if order_json is not None:
+                return order_json, 200
+
+        url = f"{self._url(orders_url, '/v1/orders')}/{order_id}"
+        response = self._request("GET", url, headers=self._headers())
+
+        if response.status_code == 200:
+            print(
+                f"Order id fetched successfuly: {order_id}. Status: {response.status_code}"
+            )
+            order_json = response.json()
+            if self.cache is not None:
+                self.cache.put_order(order_id, order_json)
+            return order_json, response.status_code
+        else:
+            print(f"Failed to fetch order {order_id}. Status: {response.status_code}")
+            print("Response:", response.text)
+            raise ExternalAPIError(
+                f"Failed to fetch order {order_id}. Status: {response.status_code}, Response: {response.text}"
+            )
+
+    def fetch_file(self, file_id, files_url=None):
+        """
+        Fetches a file (base64 FileContent) from the Billit API.
+
+        Returns:
+            tuple: (file JSON, status code)
+        """
+        if self.cache is not None:
+            file_json = self.cache.get_file(file_id)
+            if file_json is not None:
+                return file_json, 200
+
+        url = f"{self._url(files_url, '/v1/files')}/{file_id}"
+        response = self._request("GET", url, headers=self._headers())
+
+        if response.status_code == 200:
+            print(
+                f"File content fetched successfuly: {file_id}. Status: {response.status_code}"
+            )
+            file_json = response.json()
+            if self.cache is not None:
+                self.cache.put_file(file_id, file_json)
+            return file_json, response.status_code
+        else:
+            print(
+                f"Failed to fetch file content for file id: {file_id}. Status: {response.status_code}"
+            )
+            print("Response:", response.text)
+            raise ExternalAPIError(
+                f"Failed to fetch file content for file id: {file_id}. Status: {response.status_code}, Response: {response.text}"
+            )
+
+    def download_file(self, file_id, destination, files_url=None, chunk_size=65536):
+        """
+        Streams a file from the Billit API and decodes its base64 FileContent into destination,
+        without holding the base64 string or an extra copy of the file in memory.
+
+        :param file_id: Billit FileID
+        :param destination: file path (written via a .part file), file-like object with write(),
+                            or bytearray (filled from the start, extended when too small)
+        :param chunk_size: bytes read from the response at a time
+        :return: tuple (file JSON without FileContent, e.g. FileName / MimeType, number of bytes written)
+        """
+        url = f"{self._url(files_url, '/v1/files')}/{file_id}"
+        with self._request("GET", url, headers=self._headers(), stream=True) as response:
+            if response.status_code != 200:
+                print(
+                    f"Failed to fetch file content for file id: {file_id}. Status: {response.status_code}"
+                )
+                print("Response:", response.text)
+                raise ExternalAPIError(
+                    f"Failed to fetch file content for file id: {file_id}. Status: {response.status_code}, Response: {response.text}"
+                )
+            chunks = response.iter_content(chunk_size)
+
+            if isinstance(destination, bytearray):
+                buffer = destination
+                offset = 0
+
+                def write(data):
+                    nonlocal offset
+                    buffer[offset : offset + len(data)] = data
+                    offset += len(data)
+
+                file_json, size = _decode_file_content(chunks, write)
+            elif isinstance(destination, (str, os.PathLike)):
+                part = f"{os.fspath(destination)}.part"
+                try:
+                    with open(part, "wb") as f:
+                        file_json, size = _decode_file_content(chunks, f.write)
+                    os.replace(part, destination)
+                except BaseException:
+                    if os.path.exists(part):
+                        os.remove(part)
+                    raise
+            else:
+                file_json, size = _decode_file_content(chunks, destination.write)
+
+        print(f"File content downloaded successfuly: {file_id}. Size: {size} bytes")
+        return file_json, size
+
+    def api_call(self, method, endpoint, params=None, data=None, raw=False):
+        """
+        Makes an authenticated call to the Billit API, endpoint relative to base_url.
+        Returns the decoded JSON, or the response body as bytes when raw is True.
+        """
+        if not self.base_url or not self.api_key:
+            raise ValueError("Billit API base URL or API Key not configured.")
+
+        url = f"{self.base_url}{endpoint}"
+        headers = {"ApiKey": self.api_key, "Accept": "application/json"}
+        if data:  # For POST/PUT if Billit ever requires them
+            headers["Content-Type"] = "application/json"
+
+        try:
+            response = self._request(
+                method, url, headers=headers, params=params, json=data
+            )
+            response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
+            return response.content if raw else response.json()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Billit API call failed: {method} {url} - {e}")
+            if hasattr(e, "response") and e.response is not None:
+                logging.error(f"Billit API Error Response: {e.response.text}")
+            raise
+
+    def list_orders(self, odata_filter=None, skip=0, top=120, orderby="LastModified asc"):
+        """
+        Fetches one page of orders from the Billit API.
+
+        :param odata_filter: OData $filter, e.g. "OrderType eq 'Invoice'"
+        :param skip: number of orders to skip
+        :param top: page size (Billit returns at most 120 per page)
+        :param orderby: OData $orderby, a stable order keeps the pages consistent
+        :return: list of orders
+        """
+        params = {"$skip": skip, "$top": top}
+        if odata_filter:
+            params["$filter"] = odata_filter
+        if orderby:
+            params["$orderby"] = orderby
+        return self.api_call("GET", "/v1/orders", params=params).get("Items", [])
+
+    def iter_orders(self, odata_filter=None, modified_since=None, page_size=120, prefetch=True):
+        """
+        Generator over all orders matching the filter, page by page in LastModified order.
+        While the caller works through a page, the next one is already being fetched.
+
+        Pages are keyset based: the next page is the orders with LastModified >= the last one
+        seen, the orders of the previous page at that LastModified are left out by OrderID.
+        With $skip an order modified during the run moves to the end and the order after it
+        shifts onto a page already fetched, and is never returned.
+        An order modified during the run is returned again with its new LastModified.
+
+        :param odata_filter: OData $filter for the orders
+        :param modified_since: datetime or ISO string, only orders with LastModified >= this
+        :param page_size: orders per API call
+        :param prefetch: fetch the next page in the background
+        """
+
+        def fetch(since, skip):
+            combined = odata_filter
+            if since:
+                since_filter = _modified_since_filter(since)
+                combined = f"({odata_filter}) and ({since_filter})" if odata_filter else since_filter
+            return self.list_orders(combined, skip, page_size, orderby="LastModified asc, OrderID asc")
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            since = modified_since
+            seen_at_since = set()  # OrderIDs already returned with LastModified == since
+            skip = 0
+            page = fetch(since, skip)
+            while True:
+                full_page = len(page) == page_size
+                new = [
+                    order
+                    for order in page
+                    if not (order.get("LastModified") == since and order.get("OrderID") in seen_at_since)
+                ]
+                last = new[-1].get("LastModified") if new else since
+                at_last = {o.get("OrderID") for o in new if o.get("LastModified") == last}
+                if last and last != since:
+                    since, seen_at_since, skip = last, at_last, 0
+                else:
+                    # the whole page has the same LastModified, page on within those orders
+                    seen_at_since |= at_last
+                    skip += len(page)
+                next_page = executor.submit(fetch, since, skip) if full_page and executor else None
+                yield from new
+                if not full_page:
+                    return
+                page = next_page.result() if next_page else fetch(since, skip)
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def sync_orders(self, cursor, odata_filter=None, page_size=120):
+        """
+        Generator over the orders changed since the previous sync with the same cursor.
+        The cursor only moves forward once all orders have been consumed, an interrupted run
+        is repeated in full next time. Orders modified exactly at the mark are returned again.
+
+        :param cursor: OrderSyncCursor or path of the cursor file
+        """
+        if not isinstance(cursor, OrderSyncCursor):
+            cursor = OrderSyncCursor(cursor)
+        since = cursor.load()
+        high_water = since
+        for order in self.iter_orders(odata_filter, since, page_size):
+            modified = order.get("LastModified")
+            if modified and (high_water is None or modified > high_water):
+                high_water = modified
+            yield order
+        if high_water != since:
+            cursor.save(high_water)
+
+    def get_order_details(self, order_id):
+        """Fetches full order details from Billit API."""
+        if self.cache is not None:
+            order_details = self.cache.get_order(order_id)
+            if order_details is not None:
+                return order_details
+        logging.info(f"Fetching order details for ID: {order_id}")
+        order_details = self.api_call("GET", f"/v1/orders/{order_id}")
+        if self.cache is not None and order_details:
+            self.cache.put_order(order_id, order_details)
+        return order_details
+
+    def get_order_model(self, order_id):
+        """Fetches an order as BillitOrder (compact, parsed on access)."""
+        if self.cache is not None:
+            order_details = self.cache.get_order(order_id)
+            if order_details is not None:
+                return BillitOrder.from_dict(order_details)
+        logging.info(f"Fetching order details for ID: {order_id}")
+        return BillitOrder(self.api_call("GET", f"/v1/orders/{order_id}", raw=True))
+
+    def get_file_content(self, file_id):
+        """Fetches file content (base64) from Billit API."""
+        if self.cache is not None:
+            file_json = self.cache.get_file(file_id)
+            if file_json is not None:
+                return file_json
+        logging.info(f"Fetching file content for FileID: {file_id}")
+        file_json = self.api_call("GET", f"/v1/files/{file_id}")
+        if self.cache is not None and file_json:
+            self.cache.put_file(file_id, file_json)
+        return file_json
+
+    def get_order_if_pdf_ready(self, order_id):
+        """
+        One poll for the order PDF: returns the order details when OrderPDF is there, else None.
+        The presence check is done on the raw body, the JSON is only decoded when the key can be there.
+        Raises BillitOrderNotFound when Billit returns no order.
+        """
+        body = self.api_call("GET", f"/v1/orders/{order_id}", raw=True)
+        if body.strip() in (b"", b"null", b"{}", b"[]"):
+            raise BillitOrderNotFound(f"No order details found for order ID {order_id}")
+        if b'"OrderPDF"' in body:
+            order_details = json.loads(body)
+            if "OrderPDF" in order_details:
+                if self.cache is not None:
+                    self.cache.put_order(order_id, order_details)
+                return order_details
+        return None
+
+    def fetch_order_with_pdf(
+        self,
+        billit_order_id,
+        max_retries=4,
+        delay=None,
+        interval=2,
+        deadline=30,
+        backoff=1.5,
+        max_interval=10,
+        jitter=0.2,
+    ):
+        """
+        Poll Billit until OrderPDF is available, retries are exhausted or the deadline passed.
+        - Initial wait: delay, by default learned from recent PDF render times (5s at first)
+        - Retry interval: interval (2s), multiplied by backoff after every poll, up to max_interval
+        - jitter: every wait is randomly shortened or lengthened by up to this fraction
+        - deadline: seconds after which no new poll is started
+        - Max retries: max_retries (default 4)
+
+        Polls that do not find the PDF skip the JSON decoding of the (possibly large) order.
+        :return: dict - the order details, including OrderPDF
+        """
+        start = time.monotonic()
+        wait = self.pdf_wait.initial_delay() if delay is None else delay
+        last_missed = None
+
+        for attempt in range(max_retries + 1):  # include final attempt
+            wait *= 1 + random.uniform(-jitter, jitter)
+            remaining = deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            time.sleep(min(wait, remaining))
+
+            order_details = self.get_order_if_pdf_ready(billit_order_id)
+            elapsed = time.monotonic() - start
+            if order_details is not None:
+                self.pdf_wait.record(elapsed, last_missed)
+                return order_details  # ✅ success
+
+            last_missed = elapsed
+            wait = interval * backoff**attempt
+            wait = min(wait, max_interval)
+
+        # ❌ Timed out waiting for PDF
+        raise BillitOrderPDFTimeout(
+            f"OrderPDF not available for order ID {billit_order_id} after {time.monotonic() - start:.1f}s"
+        )
+
+
+# --- Background PDF readiness poller ---
+# fetch_order_with_pdf keeps the calling thread asleep until the PDF is rendered. PdfReadinessPoller
+# takes that waiting off the request workers: orders are handed to one scheduler thread that polls
+# the due orders in batches and resolves a concurrent.futures.Future per order.
+# From asyncio code, await asyncio.wrap_future(future).
+class PdfReadinessPoller:
+    """
+    Polls Billit for the OrderPDF of many pending orders on a single background thread.
+
+    :param client: BillitClient used for the polls
+    :param interval: first retry interval in seconds after a poll without PDF
+    :param backoff: factor applied to the retry interval after every poll without PDF
+    :param max_interval: upper bound of the retry interval
+    :param deadline: seconds after which an order fails with BillitOrderPDFTimeout
+    :param batch_size: maximum number of orders polled per scheduler round
+    """
+
+    def __init__(
+        self,
+        client,
+        interval=2,
+        backoff=1.5,
+        max_interval=10,
+        deadline=120,
+        batch_size=16,
+    ):
+        self.client = client
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self._pending = {}  # order_id -> pending entry (dict)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, order_id, callback=None, deadline=None):
+        """
+        Starts waiting for the PDF of an order, returns immediately.
+
+        :param order_id: Billit order id
+        :param callback: called with the Future once it is resolved (PDF found or failed)
+        :param deadline: seconds to wait for this order, defaults to the poller's deadline
+        :return: concurrent.futures.Future - result is the order details including OrderPDF,
+                 or BillitOrderNotFound / BillitOrderPDFTimeout / the API error as exception.
+                 Cancelling it stops the polling of the order.
+        """
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("PdfReadinessPoller is stopped")
+            entry = self._pending.get(order_id)
+            if entry is None or entry["future"].done():
+                now = time.monotonic()
+                entry = {
+                    "future": Future(),
+                    "started": now,
+                    "deadline": now + (self.deadline if deadline is None else deadline),
+                    "next_poll": now + self.client.pdf_wait.initial_delay(),
+                    "wait": self.interval,
+                    "last_missed": None,
+                }
+                self._pending[order_id] = entry
+                self._ensure_thread()
+                self._condition.notify()
+                # a cancelled future (e.g. by asyncio.wrap_future) is no longer polled
+                entry["future"].add_done_callback(
+                    lambda _, order_id=order_id, entry=entry: self._finish(order_id, entry)
+                )
+        future = entry["future"]
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def watch_many(self, order_ids, callback=None, deadline=None):
+        """Starts waiting for the PDFs of many orders, returns {order_id: Future}."""
+        return {
+            order_id: self.watch(order_id, callback, deadline) for order_id in order_ids
+        }
+
+    def pending(self):
+        """Number of orders still waiting for their PDF."""
+        with self._condition:
+            return len(self._pending)
+
+    def stop(self, cancel_pending=True):
+        """
+        Stops the scheduler thread, no new orders can be watched.
+
+        :param cancel_pending: True cancels the pending futures, False keeps polling them
+                               and returns once all are resolved (at the latest at their deadline)
+        """
+        with self._condition:
+            self._stopped = True
+            entries = list(self._pending.values()) if cancel_pending else []
+            if cancel_pending:
+                self._pending.clear()
+            self._condition.notify()
+        for entry in entries:
+            entry["future"].cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="billit-pdf-poller", daemon=True
+            )
+            self._thread.start()
+
+    def _due_batch(self):
+        """
+        Waits until orders are due, returns up to batch_size (order_id, entry) pairs.
+        Returns [] once stopped and nothing is pending anymore.
+        """
+        with self._condition:
+            while True:
+                if not self._pending:
+                    if self._stopped:
+                        return []
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                next_poll = min(entry["next_poll"] for entry in self._pending.values())
+                if next_poll > now:
+                    self._condition.wait(next_poll - now)
+                    continue
+                due = [
+                    (order_id, entry)
+                    for order_id, entry in self._pending.items()
+                    if entry["next_poll"] <= now
+                ]
+                due.sort(key=lambda item: item[1]["next_poll"])
+                return due[: self.batch_size]
+
+    def _run(self):
+        while True:
+            batch = self._due_batch()
+            if not batch:
+                return
+            for order_id, entry in batch:
+                try:
+                    self._poll(order_id, entry)
+                except Exception as e:
+                    # one order must not stop the polling of the others
+                    logging.exception(f"PDF poller failed on order {order_id}")
+                    self._resolve(order_id, entry, exception=e)
+
+    def _poll(self, order_id, entry):
+        if entry["future"].done():  # cancelled by the caller
+            self._finish(order_id, entry)
+            return
+        try:
+            order_details = self.client.get_order_if_pdf_ready(order_id)
+        except BillitUnavailable:
+            order_details = None  # Billit is down, keep waiting until the deadline
+        except Exception as e:
+            self._resolve(order_id, entry, exception=e)
+            return
+
+        now = time.monotonic()
+        elapsed = now - entry["started"]
+        if order_details is not None:
+            self.client.pdf_wait.record(elapsed, entry["last_missed"])
+            self._resolve(order_id, entry, result=order_details)
+            return
+
+        if now >= entry["deadline"]:
+            self._resolve(
+                order_id,
+                entry,
+                exception=BillitOrderPDFTimeout(
+                    f"OrderPDF not available for order ID {order_id} after {elapsed:.1f}s"
+                ),
+            )
+            return
+
+        entry["last_missed"] = elapsed
+        wait = entry["wait"] * (1 + random.uniform(-0.2, 0.2))
+        entry["next_poll"] = min(now + wait, entry["deadline"])
+        entry["wait"] = min(entry["wait"] * self.backoff, self.max_interval)
+
+    def _resolve(self, order_id, entry, result=None, exception=None):
+        self._finish(order_id, entry)
+        future = entry["future"]
+        # False when the caller cancelled the future, a running future cannot be cancelled anymore
+        if not future.set_running_or_notify_cancel():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def _finish(self, order_id, entry):
+        with self._condition:
+            if self._pending.get(order_id) is entry:
+                del self._pending[order_id]
+                self._condition.notify()
+
+
+# --- Shared clients ---
+# The module-level functions below keep their v3 signatures, they reuse one client
+# (and so one connection pool) per API key + base URL.
+_billit_clients = {}
+_billit_clients_lock = threading.Lock()
+_billit_caches = {}  # API key -> BillitCache, shared by the clients of that key
+
+
+def get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL=None):
+    """
+    Returns the shared BillitClient for this API key and base URL.
+    The clients of one API key (with and without base URL) share their session, circuit
+    breaker, PDF wait estimate and cache: they talk to the same Billit account.
+    """
+    key = (BILLIT_API_KEY, BILLIT_BASE_URL)
+    client = _billit_clients.get(key)
+    if client is None:
+        with _billit_clients_lock:
+            client = _billit_clients.get(key)
+            if client is None:
+                sibling = next(
+                    (c for (api_key, _), c in _billit_clients.items() if api_key == BILLIT_API_KEY),
+                    None,
+                )
+                if sibling is None:
+                    client = BillitClient(BILLIT_API_KEY, BILLIT_BASE_URL)
+                else:
+                    client = BillitClient(
+                        BILLIT_API_KEY,
+                        BILLIT_BASE_URL,
+                        session=sibling.session,
+                        circuit_breaker=sibling.circuit_breaker,
+                    )
+                    client.pdf_wait = sibling.pdf_wait
+                client.cache = _billit_caches.get(BILLIT_API_KEY)
+                _billit_clients[key] = client
+    return client
+
+
+def enable_billit_cache(BILLIT_API_KEY, max_items=256, order_ttl=300, disk_dir=None):
+    """
+    Caches orders and files fetched with this API key (get_billit_order, fetch_billit_file,
+    get_billit_order_details, get_billit_file_content). See BillitCache.
+    :return: BillitCache
+    """
+    cache = BillitCache(max_items, order_ttl, disk_dir)
+    with _billit_clients_lock:
+        _billit_caches[BILLIT_API_KEY] = cache
+        for (api_key, _), client in _billit_clients.items():
+            if api_key == BILLIT_API_KEY:
+                client.cache = cache
+    return cache
+
+
+def invalidate_billit_order(order_id, BILLIT_API_KEY):
+    """Drops an order from the cache of this API key, e.g. after changing it in Billit."""
+    cache = _billit_caches.get(BILLIT_API_KEY)
+    if cache is not None:
+        cache.invalidate_order(order_id)
+
+
+_pdf_pollers = {}
+
+
+def get_pdf_poller(BILLIT_API_KEY, BILLIT_BASE_URL=None):
+    """Returns the shared PdfReadinessPoller for this API key and base URL."""
+    key = (BILLIT_API_KEY, BILLIT_BASE_URL)
+    poller = _pdf_pollers.get(key)
+    if poller is None:
+        client = get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL)
+        with _billit_clients_lock:
+            poller = _pdf_pollers.get(key)
+            if poller is None:
+                poller = _pdf_pollers[key] = PdfReadinessPoller(client)
+    return poller
+
+
+# Function to post an order to Billit
+# This function takes a payload, which is a JSON object,
+# and sends it to the Billit API to create an order.
+# It returns the response from Billit.
+# please note that this only posts the order to Billit, next the order needs to be sent
+def post_order_to_billit(payload, BILLIT_API_KEY, BILLIT_ORDERS_URL):
+    return get_billit_client(BILLIT_API_KEY).post_order(payload, BILLIT_ORDERS_URL)
+
+
+def send_order(order_id, transport_type, BILLIT_API_KEY, BILLIT_SEND_INVOICE_URL):
+    """
+    Sends an order to Billit using the provided order ID and method of transport.
+
+    :param order_id: str - The ID of the order to send
+    :param method_of_transport: str - The method of transport for the order
+    :return: Response from the Billit API
+    """
+    return get_billit_client(BILLIT_API_KEY).send_order(
+        order_id, transport_type, BILLIT_SEND_INVOICE_URL
+    )
+
+
+def send_orders(
+    order_ids, transport_type, BILLIT_API_KEY, BILLIT_SEND_INVOICE_URL, chunk_size=50
+):
+    """
+    Sends many orders to Billit in as few API calls as possible.
+    Returns a result per order, see BillitClient.send_orders.
+    """
+    return get_billit_client(BILLIT_API_KEY).send_orders(
+        order_ids, transport_type, chunk_size, BILLIT_SEND_INVOICE_URL
+    )
+
+
+def get_billit_order(order_id, BILLIT_API_KEY, BILLIT_ORDERS_URL):
+    """
+    Fetches an order from the Billit API based on order_id.
+
+    Returns:
+        tuple: (order JSON, status code)
+    """
+    return get_billit_client(BILLIT_API_KEY).get_order(order_id, BILLIT_ORDERS_URL)
+
+
+def fetch_billit_file(file_id, BILLIT_API_KEY, BILLIT_FILES_URL):
+    return get_billit_client(BILLIT_API_KEY).fetch_file(file_id, BILLIT_FILES_URL)
+
+
+def download_billit_file(
+    file_id, destination, BILLIT_API_KEY, BILLIT_FILES_URL, chunk_size=65536
+):
+    """
+    Streaming variant of fetch_billit_file: FileContent is decoded straight into destination
+    (file path, file-like object or bytearray). See BillitClient.download_file.
+    """
+    return get_billit_client(BILLIT_API_KEY).download_file(
+        file_id, destination, BILLIT_FILES_URL, chunk_size
+    )
+
+
+# --- Helper functions for Billit API ---
+def _billit_api_call(
+    method, endpoint, BILLIT_API_KEY, BILLIT_BASE_URL, params=None, data=None
+):
+    """
+    Helper to make authenticated calls to the Billit API.
+    """
+    return get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL).api_call(
+        method, endpoint, params=params, data=data
+    )
+
+
+def get_billit_order_details(order_id, BILLIT_API_KEY, BILLIT_BASE_URL):
+    """Fetches full order details from Billit API."""
+    return get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL).get_order_details(order_id)
+
+
+def get_billit_order_model(order_id, BILLIT_API_KEY, BILLIT_BASE_URL):
+    """Fetches an order as compact BillitOrder view, see BillitOrder."""
+    return get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL).get_order_model(order_id)
+
+
+def get_billit_file_content(file_id, BILLIT_API_KEY, BILLIT_BASE_URL):
+    """Fetches file content (base64) from Billit API."""
+    return get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL).get_file_content(file_id)
+
+
+def iter_billit_orders(
+    BILLIT_API_KEY, BILLIT_BASE_URL, odata_filter=None, modified_since=None, page_size=120
+):
+    """Generator over all Billit orders matching the filter, see BillitClient.iter_orders."""
+    return get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL).iter_orders(
+        odata_filter, modified_since, page_size
+    )
+
+
+def sync_billit_orders(cursor_path, BILLIT_API_KEY, BILLIT_BASE_URL, odata_filter=None):
+    """
+    Generator over the Billit orders changed since the last run with this cursor file,
+    see BillitClient.sync_orders.
+    """
+    return get_billit_client(BILLIT_API_KEY, BILLIT_BASE_URL).sync_orders(
+        cursor_path, odata_filter
+    )
+
+
+def fetch_order_with_pdf(
+    billit_order_id,
+    api_key,
+    base_url,
+    max_retries=4,
+    delay=None,
+    interval=2,
+    deadline=30,
+    backoff=1.5,
+    jitter=0.2,
+):
+    """
+    Poll Billit until OrderPDF is available, retries are exhausted or the deadline passed.
+    - Initial wait: learned from recent PDF render times (5s at first), or delay
+    - Retry interval: 2s, growing by backoff after every poll
+    - Max retries: max_retries (default 4)
+    See BillitClient.fetch_order_with_pdf.
+    """
+    return get_billit_client(api_key, base_url).fetch_order_with_pdf(
+        billit_order_id,
+        max_retries=max_retries,
+        delay=delay,
+        interval=interval,
+        deadline=deadline,
+        backoff=backoff,
+        jitter=jitter,
+    )
+
+
+def watch_order_pdf(billit_order_id, api_key, base_url, callback=None, deadline=None):
+    """
+    Non-blocking variant of fetch_order_with_pdf: the order is polled on the shared
+    background poller and a concurrent.futures.Future is returned immediately.
+    callback is called with the Future once the PDF is there (or polling failed).
+    """
+    return get_pdf_poller(api_key, base_url).watch(billit_order_id, callback, deadline)
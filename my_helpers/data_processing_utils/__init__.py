@@ -1 +1 @@
-from my_helpers.data_processing_utils.data_procesing_utils_v1 import *
\ No newline at end of file
+from my_helpers.data_processing_utils.data_procesing_utils_v2 import *
\ No newline at end of file
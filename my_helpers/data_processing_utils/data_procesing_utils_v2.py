@@ -0,0 +1,1547 @@
+# 20250909, Marc De Krock
+# cleaning updated to support \u20ac removal
+# cleaning update to support 17-05-2023 => 2025-05-17
+# 20261017: clean_json_data now runs as one fused traversal (compile_cleaning_pipeline)
+#           instead of seven recursive passes, the per-leaf logic lives in *_key / *_value functions
+# 20261017: removed the BEFORE/AFTER json.dumps prints, use clean_json_data(data, trace=True) instead
+# 20261017: regexes are precompiled once in LEAF_MATCHERS, with a first-character prefilter
+# 20261017: dates are parsed by compile_date_normalizer (shape check, fixed-layout parser, memoised)
+#           instead of datetime.strptime on every string
+# 20261017: added clean_json_stream / iter_json_items for documents too large to json.loads
+# 20261017: added clean_rows_columnar for batches of rows with the same keys (uses NumPy if installed)
+# 20261017: added clean_json_data_many to clean many documents in a process pool
+# 20261017: address parsing is cached (parse_address / parse_addresses), the supplier and customer
+#           template splitters share one implementation
+# 20261017: added compile_mapping, map_json reports all missing keys in one warning
+# 20261017: the recursive cleaners accept inplace=True (mutate the input) and share=True
+#           (reuse unchanged subtrees), they all run on compile_cleaning_pipeline now
+import codecs
+import io
+import math
+import os
+import re
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache, partial
+from itertools import islice
+import json
+import logging
+from json.decoder import scanstring
+
+try:
+    import numpy as np
+
+    _np_strings = getattr(np, "strings", np.char)  # np.strings since NumPy 2.0
+except ImportError:  # NumPy is optional, clean_rows_columnar falls back to pure Python
+    np = None
+
+
+# *****************************************************
+# ** Precompiled leaf matchers **
+# The cleaners test every string leaf against a pattern. Compiling the patterns once
+# avoids the re module cache lookup per call, and the first-character check rejects
+# most strings (names, descriptions, ...) without entering the regex engine at all.
+LEAF_MATCHERS = {}
+
+
+def register_leaf_matcher(name, pattern, first_char=None, flags=0, fullmatch=False):
+    """
+    Compiles a pattern once and registers it in LEAF_MATCHERS.
+
+    :param name: name under which the matcher is registered
+    :param pattern: regular expression
+    :param first_char: optional function char -> bool, strings whose first character
+                       fails this check are rejected without running the regex
+    :param flags: re flags
+    :param fullmatch: use fullmatch instead of match
+    :return: function string -> match object or None
+    """
+    regex = re.compile(pattern, flags)
+    match = regex.fullmatch if fullmatch else regex.match
+
+    if first_char is None:
+        matcher = match
+    else:
+
+        def matcher(value):
+            if value and first_char(value[0]):
+                return match(value)
+            return None
+
+    LEAF_MATCHERS[name] = matcher
+    return matcher
+
+
+def _is_decimal_char(char):
+    # same characters as \d in a str pattern (Unicode category Nd)
+    return char.isdecimal()
+
+
+_match_money = register_leaf_matcher(
+    "money",
+    r"^€?\s*[\d,]+\.\d{1,2}$",  # Allow 1 or 2 decimal places
+    first_char=lambda char: char == "€" or char == "," or char.isdecimal(),
+)
+_match_vat = register_leaf_matcher(
+    "vat", r"^\d+(\.\d+)?%$", first_char=_is_decimal_char
+)
+_match_decimal = register_leaf_matcher(
+    "decimal", r"\d+\.\d+", first_char=_is_decimal_char, fullmatch=True
+)
+_match_box = register_leaf_matcher(
+    "address_box",
+    r"^box\s*(\d+)$",
+    first_char=lambda char: char in "bB",
+    flags=re.IGNORECASE,
+)
+_match_street = register_leaf_matcher(
+    "address_street",
+    r"""^(.*?)              # Street name
+        [\s,]+              # Space or comma
+        (\d+)               # House number
+        (?:\s*[-]\s*(\d+))? # Optional: hyphen followed by box number
+    $""",
+    flags=re.IGNORECASE | re.VERBOSE,
+)
+
+
+# *****************************************************
+# ** Single-pass cleaning engine **
+# Every cleaner in this module is a key transform or a value transform applied to the
+# whole structure. compile_cleaning_pipeline chains them, so that clean_json_data walks
+# the payload once instead of once per step. By default the result is a fresh copy,
+# inplace=True mutates the dicts and lists of the caller instead, and share=True only
+# copies the containers in which something changed (unchanged subtrees are reused).
+_CONTAINER_TYPES = (dict, list)
+
+
+def _identity(value):
+    return value
+
+
+def _chain(transforms):
+    transforms = tuple(transforms)
+    if not transforms:
+        return _identity
+    if len(transforms) == 1:
+        return transforms[0]
+
+    def chained(value):
+        for transform in transforms:
+            value = transform(value)
+        return value
+
+    return chained
+
+
+def _same_key(new_key, key):
+    return new_key is key or (type(new_key) is type(key) and new_key == key)
+
+
+def compile_cleaning_pipeline(key_transforms=(), value_transforms=()):
+    """
+    Compiles ordered key and value transforms into a single-pass cleaner.
+
+    Key transforms are applied in order to every dict key, value transforms in order
+    to every leaf (anything that is not a dict or list). The result is the same as
+    running the matching recursive cleaners one after another.
+
+    :param key_transforms: list of functions key -> key (e.g. capitalize_key)
+    :param value_transforms: list of functions leaf -> leaf (e.g. clean_vat_value)
+    :return: function clean(data, inplace=False, share=False) -> cleaned data
+             inplace: mutate the dicts and lists of data (only for data the caller owns)
+             share: reuse the unchanged dicts and lists of data in the result
+    """
+    key_fn = _chain(key_transforms)
+    value_fn = _chain(value_transforms)
+    rename_keys = key_fn is not _identity
+
+    def clean_copy(data):
+        if isinstance(data, dict):
+            return {
+                key_fn(key): (
+                    clean_copy(value)
+                    if isinstance(value, _CONTAINER_TYPES)
+                    else value_fn(value)
+                )
+                for key, value in data.items()
+            }
+        elif isinstance(data, list):
+            return [
+                clean_copy(item) if isinstance(item, _CONTAINER_TYPES) else value_fn(item)
+                for item in data
+            ]
+        else:
+            return value_fn(data)
+
+    def clean_inplace(data):
+        if isinstance(data, dict):
+            if rename_keys:
+                # re-insert to apply the new keys, in the original order
+                items = list(data.items())
+                data.clear()
+                for key, value in items:
+                    data[key_fn(key)] = clean_inplace(value)
+            else:
+                for key, value in data.items():
+                    data[key] = clean_inplace(value)
+            return data
+        elif isinstance(data, list):
+            for index, item in enumerate(data):
+                data[index] = clean_inplace(item)
+            return data
+        else:
+            return value_fn(data)
+
+    def clean_shared(data):
+        if isinstance(data, dict):
+            result = None
+            for index, (key, value) in enumerate(data.items()):
+                new_key = key_fn(key)
+                new_value = clean_shared(value)
+                if result is None:
+                    if new_value is value and _same_key(new_key, key):
+                        continue
+                    # first change: copy the unchanged items seen so far
+                    result = dict(islice(data.items(), index))
+                result[new_key] = new_value
+            return data if result is None else result
+        elif isinstance(data, list):
+            result = None
+            for index, item in enumerate(data):
+                new_item = clean_shared(item)
+                if result is None:
+                    if new_item is item:
+                        continue
+                    result = data[:index]
+                result.append(new_item)
+            return data if result is None else result
+        else:
+            return value_fn(data)
+
+    def clean(data, inplace=False, share=False):
+        if inplace:
+            return clean_inplace(data)
+        if share:
+            return clean_shared(data)
+        return clean_copy(data)
+
+    return clean
+
+
+# *****************************************************
+def capitalize_key(key):
+    return key[0].upper() + key[1:] if key else key
+
+
+_capitalize_keys = compile_cleaning_pipeline(key_transforms=[capitalize_key])
+
+
+def capitalize_keys(data, inplace=False, share=False):
+    return _capitalize_keys(data, inplace, share)
+
+
+# *****************************************************
+def replace_empty_value(value):
+    return "-" if value in ("", None) else value
+
+
+_replace_empty_values = compile_cleaning_pipeline(value_transforms=[replace_empty_value])
+
+
+def replace_empty_values(data, inplace=False, share=False):
+    return _replace_empty_values(data, inplace, share)
+
+
+# *****************************************************
+def clean_money_value(value):
+    if not isinstance(value, str):
+        return value
+    # Match and clean Euro-formatted money strings like "€1,752.66"
+    if _match_money(value.strip()):
+        return value.replace("€", "").replace(",", "").strip()
+    return value
+
+
+_clean_money_in_json = compile_cleaning_pipeline(value_transforms=[clean_money_value])
+
+
+def clean_money_in_json(data, inplace=False, share=False):
+    return _clean_money_in_json(data, inplace, share)
+
+
+def clean_money_value_2(value):
+    if not isinstance(value, str):
+        return value
+    s = value.strip()
+    # Always strip euro symbol and spaces
+    s = s.replace("€", "").replace("\u20ac", "").replace(" ", "")
+    # If it contains digits, assume it's numeric
+    if any(ch.isdigit() for ch in s):
+        # Convert European format -> dot decimals
+        if "," in s:
+            s = s.replace(".", "").replace(",", ".")
+        try:
+            return float(s)
+        except ValueError:
+            return s
+    return value
+
+
+_clean_money_in_json_2 = compile_cleaning_pipeline(value_transforms=[clean_money_value_2])
+
+
+def clean_money_in_json_2(data, inplace=False, share=False):
+    return _clean_money_in_json_2(data, inplace, share)
+
+
+# *****************************************************
+def extract_vat_percentage(vat_string):
+    return int(float(vat_string.strip().replace("%", "")))
+
+
+# *****************************************************
+def clean_vat_value(value):
+    if not isinstance(value, str):
+        return value
+    s = value.strip()
+    if _match_vat(s):
+        return int(float(s.replace("%", "")))
+    return value
+
+
+_clean_vat_in_json = compile_cleaning_pipeline(value_transforms=[clean_vat_value])
+
+
+def clean_vat_in_json(data, inplace=False, share=False):
+    return _clean_vat_in_json(data, inplace, share)
+
+
+# *****************************************************
+def normalize_key(key):
+    return key.replace(" ", "_")
+
+
+_normalize_keys = compile_cleaning_pipeline(key_transforms=[normalize_key])
+
+
+def normalize_keys(data, inplace=False, share=False):
+    return _normalize_keys(data, inplace, share)
+
+
+# *****************************************************
+# ** Fast date normalizer **
+# datetime.strptime is slow, and raising ValueError for every name or description is
+# even slower. Formats built from %d, %m and %Y with punctuation separators are parsed
+# by hand with the same rules as strptime, anything else still goes through strptime.
+# Parsed candidates are memoised: the same order and due dates repeat on every line.
+_DATE_FIELD_WIDTHS = {"d": (1, 2), "m": (1, 2), "Y": (4, 4)}
+_DATE_FIELD_FIRST_CHARS = {"d": "0123456789 ", "m": "0123456789", "Y": None}
+
+
+def _compile_date_layout(input_format):
+    """
+    Splits a strptime format like "%m/%d/%Y" into [("m", None), ("literal", "/"), ...].
+    Returns None when the fixed-layout parser can not handle the format.
+    """
+    layout = []
+    for part in re.split(r"(%.)", input_format):
+        if not part:
+            continue
+        if part[0] == "%":
+            field = part[1]
+            if field not in _DATE_FIELD_WIDTHS:
+                return None
+            layout.append((field, None))
+        elif "%" in part or any(char.isalnum() or char.isspace() for char in part):
+            return None
+        else:
+            layout.append(("literal", part))
+
+    fields = [kind for kind, _ in layout if kind != "literal"]
+    if sorted(fields) != ["Y", "d", "m"]:
+        return None
+    # every field must be closed by a separator (or the end of the string)
+    for (kind, _), (next_kind, _) in zip(layout, layout[1:]):
+        if kind != "literal" and next_kind != "literal":
+            return None
+    return layout
+
+
+def _date_field_ends(field, value, pos):
+    """Possible end positions of a field starting at pos, in strptime's order of preference"""
+    first = value[pos : pos + 1]
+    second = value[pos + 1 : pos + 2]
+    ends = []
+    if field == "Y":
+        # strptime uses \d\d\d\d, which accepts any Unicode decimal digit
+        if len(value) >= pos + 4 and value[pos : pos + 4].isdecimal():
+            ends.append(pos + 4)
+    elif field == "m":
+        # 1[0-2]|0[1-9]|[1-9]
+        if second and (
+            (first == "1" and second in "012") or (first == "0" and second in "123456789")
+        ):
+            ends.append(pos + 2)
+        if first and first in "123456789":
+            ends.append(pos + 1)
+    else:
+        # 3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9]
+        if second and (
+            (first == "3" and second in "01")
+            or (first in ("1", "2") and second.isdecimal())
+            or (first == "0" and second in "123456789")
+        ):
+            ends.append(pos + 2)
+        if first and first in "123456789":
+            ends.append(pos + 1)
+        if first == " " and second and second in "123456789":
+            ends.append(pos + 2)
+    return ends
+
+
+def _parse_date_layout(layout, value):
+    """Returns (year, month, day) when value matches the layout, else None"""
+    pos = 0
+    fields = {}
+    last = len(layout) - 1
+    for index, (kind, text) in enumerate(layout):
+        if kind == "literal":
+            if not value.startswith(text, pos):
+                return None
+            pos += len(text)
+            continue
+        separator = layout[index + 1][1] if index < last else None
+        for end in _date_field_ends(kind, value, pos):
+            if separator is None or value.startswith(separator, end):
+                break
+        else:
+            return None
+        fields[kind] = int(value[pos:end])
+        pos = end
+    if pos != len(value):
+        return None
+    return fields["Y"], fields["m"], fields["d"]
+
+
+def _date_layout_shape(layout):
+    """(min length, max length, first-character check) of the strings a layout can match"""
+    min_len = max_len = 0
+    for kind, text in layout:
+        if kind == "literal":
+            min_len += len(text)
+            max_len += len(text)
+        else:
+            min_len += _DATE_FIELD_WIDTHS[kind][0]
+            max_len += _DATE_FIELD_WIDTHS[kind][1]
+    kind, text = layout[0]
+    if kind == "literal":
+        first_char = text[0].__eq__
+    elif _DATE_FIELD_FIRST_CHARS[kind] is None:
+        first_char = str.isdecimal
+    else:
+        first_char = _DATE_FIELD_FIRST_CHARS[kind].__contains__
+    return min_len, max_len, first_char
+
+
+def compile_date_normalizer(input_formats, output_format="%Y-%m-%d", cache_size=4096):
+    """
+    Compiles a function that rewrites date strings in any of the input formats to output_format.
+
+    The input formats are tried in order, the first one that parses wins. Strings that can
+    not be a date in any of the formats (wrong length or first character) are returned
+    without parsing, the others are memoised.
+
+    :param input_formats: list of strptime formats, e.g. ["%m/%d/%Y", "%d-%m-%Y"]
+    :param output_format: strftime format of the result
+    :param cache_size: number of parsed date candidates to remember
+    :return: function value -> reformatted date string, or value unchanged
+    """
+    if isinstance(input_formats, str):
+        input_formats = [input_formats]
+    parsers = []
+    shapes = []
+    for input_format in input_formats:
+        layout = _compile_date_layout(input_format)
+        if layout is None:
+            # not a fixed layout: strptime, without a shape check
+            parsers.append((None, input_format))
+            shapes = None
+        else:
+            parsers.append((layout, input_format))
+            if shapes is not None:
+                shapes.append(_date_layout_shape(layout))
+
+    @lru_cache(maxsize=cache_size)
+    def parse_candidate(value):
+        for layout, input_format in parsers:
+            try:
+                if layout is None:
+                    dt = datetime.strptime(value, input_format)
+                else:
+                    parsed = _parse_date_layout(layout, value)
+                    if parsed is None:
+                        continue
+                    dt = datetime(*parsed)
+                return dt.strftime(output_format)
+            except ValueError:
+                continue  # e.g. 02/30/2023, try the next format
+        return value  # Not a date string, return as-is
+
+    def normalize(value):
+        if not isinstance(value, str):
+            return value
+        if shapes is not None:
+            length = len(value)
+            for min_len, max_len, first_char in shapes:
+                if min_len <= length <= max_len and first_char(value[0]):
+                    break
+            else:
+                return value
+        return parse_candidate(value)
+
+    return normalize
+
+
+_date_normalizers = {}
+_date_pipelines = {}
+
+
+def _get_date_normalizer(input_formats, output_format):
+    key = (tuple(input_formats), output_format)
+    normalizer = _date_normalizers.get(key)
+    if normalizer is None:
+        normalizer = _date_normalizers[key] = compile_date_normalizer(
+            input_formats, output_format
+        )
+    return normalizer
+
+
+# ** FUNCTION to make the dates in the JSON normalized **
+def reformat_date_value(value, input_format="%m/%d/%Y", output_format="%d/%m/%Y"):
+    if not isinstance(value, str):
+        return value
+    return _get_date_normalizer((input_format,), output_format)(value)
+
+
+def reformat_dates_in_json(
+    data, input_format="%m/%d/%Y", output_format="%d/%m/%Y", inplace=False, share=False
+):
+    """
+    Recursively reformats date strings in a nested JSON-like structure.
+
+    :param data: The JSON-like structure (dict/list)
+    :param input_format: The expected format of the input date strings
+    :param output_format: The desired format of the output date strings
+    :param inplace: reformat the dates in data itself instead of in a copy
+    :param share: only copy the dicts / lists in which a date changed
+    :return: A new structure with reformatted date strings
+    """
+    key = (input_format, output_format)
+    pipeline = _date_pipelines.get(key)
+    if pipeline is None:
+        normalizer = _get_date_normalizer((input_format,), output_format)
+        pipeline = _date_pipelines[key] = compile_cleaning_pipeline(
+            value_transforms=[normalizer]
+        )
+    return pipeline(data, inplace, share)
+
+
+# *****************************************************
+def convert_numeric_string(value):
+    if not isinstance(value, str):
+        return value
+    s = value.strip().replace(",", "")
+    # Both conversions below need a leading digit
+    if not s or not s[0].isdigit():
+        return value
+
+    # Try float first (to support decimals), then int if applicable
+    if _match_decimal(s):
+        return float(s)
+    elif s.isdigit():
+        return int(s)
+    else:
+        return value
+
+
+_convert_numeric_strings = compile_cleaning_pipeline(value_transforms=[convert_numeric_string])
+
+
+def convert_numeric_strings(data, inplace=False, share=False):
+    return _convert_numeric_strings(data, inplace, share)
+
+
+# The steps of clean_json_data, in the order they used to run as separate passes
+CLEAN_JSON_KEY_TRANSFORMS = [capitalize_key, normalize_key]
+CLEAN_JSON_VALUE_TRANSFORMS = [
+    clean_money_value_2,
+    clean_vat_value,
+    # 05/17/2023 => 2023-05-17, else 17-05-2023 => 2023-05-17
+    compile_date_normalizer(["%m/%d/%Y", "%d-%m-%Y"], "%Y-%m-%d"),
+    convert_numeric_string,
+]
+
+_clean_json_pipeline = compile_cleaning_pipeline(
+    CLEAN_JSON_KEY_TRANSFORMS, CLEAN_JSON_VALUE_TRANSFORMS
+)
+
+
+# The same steps as separate named passes, only used when tracing or timing clean_json_data
+CLEAN_JSON_STAGES = [
+    ("capitalize_keys", capitalize_keys),
+    ("clean_money_in_json_2", clean_money_in_json_2),
+    ("clean_vat_in_json", clean_vat_in_json),
+    ("normalize_keys", normalize_keys),
+    (
+        "reformat_dates_in_json %m/%d/%Y",
+        partial(reformat_dates_in_json, input_format="%m/%d/%Y", output_format="%Y-%m-%d"),
+    ),
+    (
+        "reformat_dates_in_json %d-%m-%Y",
+        partial(reformat_dates_in_json, input_format="%d-%m-%Y", output_format="%Y-%m-%d"),
+    ),
+    ("convert_numeric_strings", convert_numeric_strings),
+]
+
+
+def trace_clean_json_data(data, snapshots=True, inplace=False, share=False):
+    """
+    Runs the clean_json_data steps one by one and records what each step did.
+
+    :param data: The JSON data to clean
+    :param snapshots: when True, a pretty-printed JSON snapshot is taken after every step
+    :param inplace: see clean_json_data
+    :param share: see clean_json_data
+    :return: tuple (cleaned data, report) where report is a list of dicts
+             {"stage": name, "seconds": duration, "snapshot": json string or None}
+    """
+    report = []
+    if snapshots:
+        report.append(
+            {"stage": "input", "seconds": 0.0, "snapshot": json.dumps(data, indent=2, default=str)}
+        )
+    for name, stage in CLEAN_JSON_STAGES:
+        start = time.perf_counter()
+        data = stage(data, inplace=inplace, share=share)
+        seconds = time.perf_counter() - start
+        snapshot = json.dumps(data, indent=2, default=str) if snapshots else None
+        report.append({"stage": name, "seconds": seconds, "snapshot": snapshot})
+    return data, report
+
+
+def clean_json_data(data, trace=False, timings=False, inplace=False, share=False):
+    """
+    Cleans the JSON data by capitalizing keys, cleaning money and VAT values, normalizing keys,
+    reformatting the dates to Peppol requirements and converting numeric strings.
+    All steps are applied in a single traversal of the data.
+
+    :param data: The JSON data to clean
+    :param trace: print a JSON snapshot of the data after every cleaning step
+    :param timings: print how long every cleaning step took
+    :param inplace: clean the dicts and lists of data itself instead of a copy,
+                    only for data the caller owns
+    :param share: only copy the dicts and lists in which something changed,
+                  the result shares the unchanged parts with data
+    :return: The cleaned JSON data
+    """
+    if not (trace or timings):
+        return _clean_json_pipeline(data, inplace, share)
+
+    # Debug path: run the steps as separate passes so they can be inspected
+    data, report = trace_clean_json_data(data, snapshots=trace, inplace=inplace, share=share)
+    if trace:
+        for entry in report:
+            print(f"clean_json_data after {entry['stage']}", entry["snapshot"])
+    if timings:
+        total = sum(entry["seconds"] for entry in report)
+        print(f"clean_json_data timings (total {total * 1000:.2f} ms):")
+        for entry in report:
+            print(f"  {entry['stage']:<35} {entry['seconds'] * 1000:8.2f} ms")
+    return data
+
+
+# *****************************************************
+# ** Streaming cleaner for very large JSON documents **
+# Bulk table dumps do not fit comfortably in memory once json.loads has built them.
+# iter_json_events reads the document chunk by chunk and yields parse events, the
+# cleaners below apply the clean_json_data transforms to those events and write the
+# result out as they go, so memory stays bounded by the chunk size and the largest
+# single string, not by the size of the document.
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_NUMBER = re.compile(r"(-?(?:0|[1-9][0-9]*))(\.[0-9]+)?([eE][-+]?[0-9]+)?")
+_JSON_CONSTANTS = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "NaN": float("nan"),
+    "Infinity": float("inf"),
+    "-Infinity": float("-inf"),
+}
+
+
+def _iter_text_chunks(source, chunk_size):
+    """Yields str chunks from a path, a text stream or a byte stream"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as stream:
+            yield from _iter_text_chunks(stream, chunk_size)
+        return
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+            if not chunk:
+                continue
+        yield chunk
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _iter_json_tokens(chunks):
+    """Yields (kind, value) tokens: structural characters, ("string", str) and ("scalar", value)"""
+    buf = ""
+    pos = 0
+    eof = False
+
+    def more(min_chars=1):
+        # drops the consumed part of the buffer and appends the next chunks, at least min_chars
+        nonlocal buf, pos, eof
+        pieces = [buf[pos:]]
+        read = 0
+        while read < min_chars:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                break
+            pieces.append(chunk)
+            read += len(chunk)
+        buf = "".join(pieces)
+        pos = 0
+
+    while True:
+        pos = _JSON_WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                return
+            more()
+            continue
+
+        char = buf[pos]
+        if char in "{}[]:,":
+            pos += 1
+            yield char, None
+        elif char == '"':
+            try:
+                value, end = scanstring(buf, pos + 1, True)
+            except json.JSONDecodeError as e:
+                incomplete = e.msg.startswith("Unterminated string") or e.pos + 6 >= len(buf)
+                if eof or not incomplete:
+                    raise
+                # the string is scanned again from its start: read as much again as is buffered,
+                # so a long string (a base64 PDF) costs linear instead of quadratic time
+                more(len(buf) - pos)
+                continue
+            pos = end
+            yield "string", value
+        else:
+            # numbers and constants must not end at the end of the buffer, unless it is the end
+            if not eof and len(buf) - pos < 32:
+                more()
+                continue
+            match = _JSON_NUMBER.match(buf, pos)
+            if match and match.end() == len(buf) and not eof:
+                # a long number running into the end of the buffer may continue in the next chunk
+                more()
+                continue
+            if match:
+                integer, frac, exp = match.groups()
+                if frac or exp:
+                    value = float(integer + (frac or "") + (exp or ""))
+                else:
+                    value = int(integer)
+                pos = match.end()
+                yield "scalar", value
+                continue
+            for name, value in _JSON_CONSTANTS.items():
+                if buf.startswith(name, pos):
+                    pos += len(name)
+                    yield "scalar", value
+                    break
+            else:
+                raise ValueError(f"Invalid JSON: unexpected character {char!r}")
+
+
+def iter_json_events(source, chunk_size=65536):
+    """
+    Parses a JSON document incrementally and yields (event, value) tuples.
+
+    Events are "start_map", "map_key", "end_map", "start_array", "end_array" and "value"
+    (value is the key or the scalar, None for the others).
+
+    :param source: file path, or a text or binary file-like object
+    :param chunk_size: number of characters / bytes read at a time
+    """
+    tokens = _iter_json_tokens(_iter_text_chunks(source, chunk_size))
+    stack = []
+    state = "value"  # value, first_value, key, first_key, colon, comma, done
+    for token, value in tokens:
+        if state in ("value", "first_value"):
+            if token == "string" or token == "scalar":
+                yield "value", value
+            elif token == "{":
+                stack.append("map")
+                yield "start_map", None
+                state = "first_key"
+                continue
+            elif token == "[":
+                stack.append("array")
+                yield "start_array", None
+                state = "first_value"
+                continue
+            elif token == "]" and state == "first_value":
+                stack.pop()
+                yield "end_array", None
+            else:
+                raise ValueError(f"Invalid JSON: expected a value, got {token!r}")
+        elif state in ("key", "first_key"):
+            if token == "string":
+                yield "map_key", value
+                state = "colon"
+                continue
+            elif token == "}" and state == "first_key":
+                stack.pop()
+                yield "end_map", None
+            else:
+                raise ValueError(f"Invalid JSON: expected a key, got {token!r}")
+        elif state == "colon":
+            if token != ":":
+                raise ValueError(f"Invalid JSON: expected ':', got {token!r}")
+            state = "value"
+            continue
+        elif state == "comma":
+            if token == ",":
+                state = "key" if stack[-1] == "map" else "value"
+                continue
+            elif token == "}" and stack[-1] == "map":
+                stack.pop()
+                yield "end_map", None
+            elif token == "]" and stack[-1] == "array":
+                stack.pop()
+                yield "end_array", None
+            else:
+                raise ValueError(f"Invalid JSON: expected ',' or end of container, got {token!r}")
+        else:
+            raise ValueError(f"Invalid JSON: extra data after the document ({token!r})")
+        # a value or container just ended
+        state = "comma" if stack else "done"
+
+    if state != "done":
+        raise ValueError("Invalid JSON: unexpected end of document")
+
+
+def iter_cleaned_json(
+    source,
+    key_transforms=CLEAN_JSON_KEY_TRANSFORMS,
+    value_transforms=CLEAN_JSON_VALUE_TRANSFORMS,
+    chunk_size=65536,
+):
+    """
+    Cleans a JSON document as a stream and yields the cleaned JSON text in pieces.
+
+    Keys and leaf values get the same transforms as in compile_cleaning_pipeline
+    (by default those of clean_json_data). When two keys of an object clean to the
+    same key, both are written, json.loads keeps the last value as clean_json_data does.
+
+    :param source: file path, or a text or binary file-like object
+    :return: generator of str pieces of roughly chunk_size characters
+    """
+    key_fn = _chain(key_transforms)
+    value_fn = _chain(value_transforms)
+    encode_str = json.encoder.encode_basestring_ascii
+    pieces = []
+    size = 0
+    # per open container: [is a map, nothing written in it yet]
+    stack = [[False, True]]
+
+    for event, value in iter_json_events(source, chunk_size):
+        if event == "map_key":
+            piece = encode_str(key_fn(value)) + ":"
+            if not stack[-1][1]:
+                piece = "," + piece
+            stack[-1][1] = False
+        elif event == "end_map" or event == "end_array":
+            stack.pop()
+            piece = "}" if event == "end_map" else "]"
+        else:
+            if event == "value":
+                value = value_fn(value)
+                piece = encode_str(value) if isinstance(value, str) else json.dumps(value)
+            elif event == "start_map":
+                piece = "{"
+            else:
+                piece = "["
+            # inside a map the key already wrote the comma
+            parent = stack[-1]
+            if not parent[0] and not parent[1]:
+                piece = "," + piece
+            parent[1] = False
+            if event != "value":
+                stack.append([event == "start_map", True])
+        pieces.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(pieces)
+            pieces = []
+            size = 0
+    if pieces:
+        yield "".join(pieces)
+
+
+def clean_json_stream(
+    source,
+    destination,
+    key_transforms=CLEAN_JSON_KEY_TRANSFORMS,
+    value_transforms=CLEAN_JSON_VALUE_TRANSFORMS,
+    chunk_size=65536,
+):
+    """
+    Cleans a (very large) JSON document from source and writes the result to destination
+    without loading the whole document in memory.
+
+    :param source: file path, or a text or binary file-like object
+    :param destination: file path, or a text or binary file-like object
+    :param key_transforms: see compile_cleaning_pipeline, defaults to clean_json_data's
+    :param value_transforms: see compile_cleaning_pipeline, defaults to clean_json_data's
+    :param chunk_size: number of characters / bytes read and written at a time
+    """
+    if isinstance(destination, (str, os.PathLike)):
+        with open(destination, "w", encoding="utf-8") as stream:
+            return clean_json_stream(
+                source, stream, key_transforms, value_transforms, chunk_size
+            )
+
+    binary = not isinstance(destination, io.TextIOBase)
+    for piece in iter_cleaned_json(source, key_transforms, value_transforms, chunk_size):
+        destination.write(piece.encode("utf-8") if binary else piece)
+
+
+def iter_json_items(source, chunk_size=65536):
+    """
+    Yields the items of a top-level JSON array one at a time (e.g. the rows of a table dump),
+    so that they can be cleaned and mapped without loading the whole array.
+    A top-level object or scalar is yielded as a single item.
+
+    :param source: file path, or a text or binary file-like object
+    """
+    stack = []  # containers being built, with the pending key for maps
+    top_level_array = None
+    for event, value in iter_json_events(source, chunk_size):
+        if top_level_array is None:
+            top_level_array = event == "start_array"
+            if top_level_array:
+                continue
+        if event == "map_key":
+            stack[-1][1] = value
+            continue
+        if event == "start_map":
+            stack.append([{}, None])
+            continue
+        if event == "start_array":
+            stack.append([[], None])
+            continue
+        if event == "end_map" or event == "end_array":
+            if not stack:  # end of the top-level array
+                continue
+            value = stack.pop()[0]
+        # attach the finished value to its parent, or yield it when it is an item
+        if stack:
+            parent, key = stack[-1]
+            if isinstance(parent, dict):
+                parent[key] = value
+            else:
+                parent.append(value)
+        else:
+            yield value
+
+
+# *****************************************************
+# ** Columnar cleaner for homogeneous row batches **
+# AppSheet rows and Billit OrderLines are lists of dicts with the same keys. Cleaning
+# them column by column means every distinct value of a column (VAT rates, dates,
+# units, ...) is cleaned only once. Value transforms with a registered column version
+# are applied to the whole column at once, vectorised with NumPy when it is installed.
+COLUMN_TRANSFORMS = {}
+
+_NUMPY_MIN_COLUMN = 64  # below this NumPy's setup costs more than it saves
+_NUMPY_MAX_STRING = 64  # NumPy stores strings at the width of the longest one
+
+
+def register_column_transform(value_transform, column_transform):
+    """
+    Registers a bulk version of a value transform for clean_rows_columnar.
+
+    :param value_transform: function leaf -> leaf, as used in compile_cleaning_pipeline
+    :param column_transform: function list -> list, must return the same as
+                             [value_transform(value) for value in values]
+    """
+    COLUMN_TRANSFORMS[value_transform] = column_transform
+
+
+def _numpy_strings(values):
+    """(positions, NumPy array) of the plain str values, or None when NumPy is not worth it"""
+    if np is None or len(values) < _NUMPY_MIN_COLUMN:
+        return None
+    positions = [i for i, value in enumerate(values) if type(value) is str]
+    if len(positions) < _NUMPY_MIN_COLUMN:
+        return None
+    strings = [values[i] for i in positions]
+    if max(map(len, strings)) > _NUMPY_MAX_STRING:
+        return None
+    # NumPy str_ arrays drop trailing NULs ('8\x00' becomes '8'), such columns stay in Python
+    if any("\x00" in string for string in strings):
+        return None
+    return positions, np.asarray(strings)
+
+
+def _numpy_ascii_mask(array):
+    if array.dtype.itemsize == 0:
+        return np.ones(len(array), dtype=bool)
+    return (array.view(np.uint32).reshape(len(array), -1) < 128).all(axis=1)
+
+
+def _numpy_plain_number_mask(array):
+    # ASCII digits with at most one dot, and at least one digit
+    without_dot = _np_strings.replace(array, ".", "", 1)
+    return _np_strings.isdecimal(without_dot) & _numpy_ascii_mask(array)
+
+
+def _merge_column(values, positions, mask, converted, value_transform):
+    # converted values where mask is set, value_transform for the other strings
+    result = list(values)
+    converted = iter(converted)
+    for i, is_converted in zip(positions, mask.tolist()):
+        result[i] = next(converted) if is_converted else value_transform(values[i])
+    return result
+
+
+def clean_money_column_2(values):
+    found = _numpy_strings(values)
+    if found is None:
+        return [clean_money_value_2(value) for value in values]
+    positions, strings = found
+    s = _np_strings.strip(strings)
+    s = _np_strings.replace(_np_strings.replace(s, "€", ""), " ", "")
+    plain = _numpy_plain_number_mask(s)
+    floats = s[plain].astype(np.float64).tolist()
+    return _merge_column(values, positions, plain, floats, clean_money_value_2)
+
+
+def clean_vat_column(values):
+    found = _numpy_strings(values)
+    if found is None:
+        return [clean_vat_value(value) for value in values]
+    positions, strings = found
+    # only strings ending in % can be a VAT rate, the others stay as they are
+    candidates = _np_strings.endswith(_np_strings.strip(strings), "%")
+    result = list(values)
+    for i, is_candidate in zip(positions, candidates.tolist()):
+        if is_candidate:
+            result[i] = clean_vat_value(values[i])
+    return result
+
+
+def convert_numeric_column(values):
+    found = _numpy_strings(values)
+    if found is None:
+        return [convert_numeric_string(value) for value in values]
+    positions, strings = found
+    s = _np_strings.replace(_np_strings.strip(strings), ",", "")
+    # \d+\.\d+ : one dot with digits on both sides
+    decimal = (
+        _numpy_plain_number_mask(s)
+        & (_np_strings.count(s, ".") == 1)
+        & ~_np_strings.startswith(s, ".")
+        & ~_np_strings.endswith(s, ".")
+    )
+    floats = s[decimal].astype(np.float64).tolist()
+    return _merge_column(values, positions, decimal, floats, convert_numeric_string)
+
+
+register_column_transform(clean_money_value_2, clean_money_column_2)
+register_column_transform(clean_vat_value, clean_vat_column)
+register_column_transform(convert_numeric_string, convert_numeric_column)
+
+
+def _clean_column(values, value_transforms, clean_nested):
+    # distinct values, keyed on the type as well so that 1, 1.0 and True stay apart,
+    # and on the sign of a float zero so that 0.0 and -0.0 stay apart
+    index = {}
+    uniques = []
+    codes = []
+    nested = {}
+    for position, value in enumerate(values):
+        if isinstance(value, _CONTAINER_TYPES):
+            nested[position] = clean_nested(value)
+            codes.append(-1)
+            continue
+        key = (type(value), value)
+        if type(value) is float and value == 0:
+            key += (math.copysign(1.0, value),)  # 0.0 == -0.0, the sign must survive
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(uniques)
+            uniques.append(value)
+        codes.append(code)
+
+    for transform in value_transforms:
+        column_transform = COLUMN_TRANSFORMS.get(transform)
+        if column_transform is not None:
+            uniques = column_transform(uniques)
+        else:
+            uniques = [transform(value) for value in uniques]
+
+    if not nested:
+        return [uniques[code] for code in codes]
+    return [
+        uniques[code] if code >= 0 else nested[position]
+        for position, code in enumerate(codes)
+    ]
+
+
+def clean_rows_columnar(
+    rows,
+    key_transforms=CLEAN_JSON_KEY_TRANSFORMS,
+    value_transforms=CLEAN_JSON_VALUE_TRANSFORMS,
+):
+    """
+    Cleans a list of row dicts that all have the same keys, column by column.
+
+    The result is the same as cleaning every row with
+    compile_cleaning_pipeline(key_transforms, value_transforms), provided the value
+    transforms only depend on the value. Rows that do not all share the same keys
+    (in the same order) are cleaned row by row.
+
+    :param rows: list of dicts, e.g. AppSheet rows or Billit OrderLines
+    :param key_transforms: see compile_cleaning_pipeline, defaults to clean_json_data's
+    :param value_transforms: see compile_cleaning_pipeline, defaults to clean_json_data's
+    :return: list of cleaned row dicts
+    """
+    rows = list(rows)
+    clean = compile_cleaning_pipeline(key_transforms, value_transforms)
+    if not rows:
+        return []
+    keys = tuple(rows[0]) if isinstance(rows[0], dict) else None
+    if keys is None or not all(
+        isinstance(row, dict) and tuple(row) == keys for row in rows
+    ):
+        return [clean(row) for row in rows]
+
+    key_fn = _chain(key_transforms)
+    clean_keys = [key_fn(key) for key in keys]
+    columns = [
+        _clean_column(column, value_transforms, clean)
+        for column in zip(*[row.values() for row in rows])
+    ]
+    if not columns:
+        return [{} for _ in rows]
+    return [dict(zip(clean_keys, values)) for values in zip(*columns)]
+
+
+# *****************************************************
+# ** Parallel cleaning of many documents **
+# clean_json_data is CPU-bound pure Python, so a batch job over thousands of orders
+# only scales with processes. Small documents are sent to the workers in batches to
+# keep the pickling / IPC overhead per document low.
+def _clean_json_batch(batch):
+    return [clean_json_data(document) for document in batch]
+
+
+def _document_weight(document):
+    # cheap size estimate: the document itself plus the items of its top-level containers
+    if isinstance(document, dict):
+        return 1 + sum(
+            len(value) for value in document.values() if isinstance(value, _CONTAINER_TYPES)
+        )
+    if isinstance(document, list):
+        return 1 + len(document)
+    return 1
+
+
+def _iter_batches(documents, batch_weight):
+    batch = []
+    weight = 0
+    for document in documents:
+        batch.append(document)
+        weight += _document_weight(document)
+        if weight >= batch_weight:
+            yield batch
+            batch = []
+            weight = 0
+    if batch:
+        yield batch
+
+
+def clean_json_data_many(documents, workers=None, batch_weight=256, max_pending=None):
+    """
+    Runs clean_json_data over many independent documents in a process pool.
+
+    Documents are grouped in batches of about batch_weight (one per document plus one per
+    item of its top-level lists / dicts, e.g. OrderLines), at most max_pending batches are
+    in flight so the input is consumed lazily. Results are yielded in input order.
+
+    :param documents: iterable of JSON documents
+    :param workers: number of processes, defaults to the number of CPUs, 1 runs in-process
+    :param batch_weight: approximate size of a batch sent to a worker
+    :param max_pending: batches in flight, defaults to 2 per worker
+    :return: generator of cleaned documents
+    """
+    workers = workers or os.cpu_count() or 1
+    batches = _iter_batches(documents, batch_weight)
+    if workers <= 1:
+        for batch in batches:
+            yield from _clean_json_batch(batch)
+        return
+
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(_clean_json_batch, batch))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+# *****************************************************
+def format_number_eu(value):
+    """Convert float to EU formatted string: 11560.00 → '11.560,00'"""
+    s = f"{value:,.2f}"  # '11,560.00'
+    s = s.replace(",", "X").replace(".", ",").replace("X", " ")
+    return s
+
+
+def try_convert_string_number(value):
+    # Try to parse as float
+    num = float(value)
+    return format_number_eu(num)
+
+
+def _convert_string_number_value(value):
+    if isinstance(value, str):
+        return try_convert_string_number(value=value)
+    return value  # Leave other types untouched (e.g., bool, None)
+
+
+_convert_string_numbers_in_json = compile_cleaning_pipeline(
+    value_transforms=[_convert_string_number_value]
+)
+
+
+def convert_string_numbers_in_json(data, inplace=False, share=False):
+    """Recursively convert numeric strings in JSON-like structure to EU format."""
+    return _convert_string_numbers_in_json(data, inplace, share)
+
+
+# *****************************************************
+# Function to merge three nested objects into a single JSON object
+# This function takes a JSON body and three nested objects (customer, supplier, order_lines),
+# and merges them into a single JSON object.
+def merge_objects(json_body, customer, supplier, order_lines):
+    # Start with a copy of object 1, but remove any existing conflicting keys
+    result = {
+        key: value
+        for key, value in json_body.items()
+        if key not in ("customer", "supplier", "order_lines")
+    }
+
+    # Add/override with the three nested objects
+    result["Customer"] = customer
+    result["Supplier"] = supplier
+    result["OrderLines"] = order_lines
+
+    return result
+
+
+# *****************************************************
+# ** Compiled mapping engine **
+# The same Billit -> AppSheet mapping is applied to every order. compile_mapping turns
+# the rules into a list of ready-made steps once, and keeps count of missing keys
+# instead of printing a warning for every one of them.
+_MISSING = object()
+
+
+def _compile_mapping_rule(input_key, rule):
+    """(input path, output path, transform or None, default) of one mapping rule"""
+    input_path = input_key if isinstance(input_key, tuple) else (input_key,)
+    transform = None
+    default = _MISSING
+    if isinstance(rule, dict):
+        output_key = rule["to"]
+        transform = rule.get("transform")
+        default = rule.get("default", _MISSING)
+    elif isinstance(rule, tuple) and not (len(rule) > 1 and (rule[1] is None or callable(rule[1]))):
+        output_key = rule  # a tuple output path, e.g. ("Customer", "Name")
+    elif isinstance(rule, tuple):
+        if len(rule) == 2:
+            output_key, transform = rule
+        elif len(rule) == 3:
+            output_key, transform, default = rule
+        else:
+            raise ValueError(f"Invalid mapping rule for '{input_key}': {rule!r}")
+    else:
+        output_key = rule
+    if not input_path:
+        raise ValueError("Empty input key path in mapping rules")
+    output_path = output_key if isinstance(output_key, tuple) else (output_key,)
+    if not output_path:
+        raise ValueError(f"Empty output key path for '{input_key}'")
+    return input_path, output_path, transform, default
+
+
+class CompiledMapping:
+    """
+    Reusable mapper built by compile_mapping.
+
+    Call it with one input dict, or use map_many for a list of inputs. Input keys that are
+    missing (and have no default) are counted in .missing, see report_missing.
+    """
+
+    def __init__(self, mapping_rules):
+        self._steps = [
+            _compile_mapping_rule(input_key, rule)
+            for input_key, rule in mapping_rules.items()
+        ]
+        self.missing = Counter()
+
+    @staticmethod
+    def _lookup(data, path):
+        for key in path:
+            if isinstance(data, dict):
+                if key not in data:
+                    return _MISSING
+            elif isinstance(data, list) and isinstance(key, int):
+                if not -len(data) <= key < len(data):
+                    return _MISSING
+            else:
+                return _MISSING
+            data = data[key]
+        return data
+
+    def __call__(self, input_data):
+        output_data = {}
+        for input_path, output_path, transform, default in self._steps:
+            if len(input_path) == 1:
+                value = input_data.get(input_path[0], _MISSING)
+            else:
+                value = self._lookup(input_data, input_path)
+            if value is _MISSING:
+                if default is _MISSING:
+                    self.missing[".".join(map(str, input_path))] += 1
+                    continue
+                value = default
+            elif transform is not None:
+                value = transform(value)
+
+            target = output_data
+            for key in output_path[:-1]:
+                target = target.setdefault(key, {})
+            target[output_path[-1]] = value
+        return output_data
+
+    def map_many(self, inputs):
+        """Applies the mapping to every input dict, returns the list of outputs."""
+        return [self(input_data) for input_data in inputs]
+
+    def report_missing(self, reset=True):
+        """
+        Logs one warning with all missing input keys and how often they were missing.
+
+        :param reset: clear the counts after reporting
+        :return: dict input key -> number of inputs it was missing from
+        """
+        missing = dict(self.missing)
+        if missing:
+            logging.warning(
+                "Input key(s) not found in input data: "
+                + ", ".join(f"'{key}' ({count}x)" for key, count in missing.items())
+            )
+        if reset:
+            self.missing.clear()
+        return missing
+
+
+def compile_mapping(mapping_rules):
+    """
+    Compiles mapping rules once into a reusable CompiledMapping.
+
+    :param mapping_rules: dict - input key -> rule
+        input key: a key, or a tuple path into nested dicts / lists, e.g. ("Customer", "Name")
+        rule:      - output key (a tuple output key creates nested dicts)
+                   - (output_key, transform_fn) or (output_key, transform_fn, default),
+                     a tuple whose second item is not a function or None is an output path
+                   - {"to": output_key, "transform": fn, "default": value}
+                   transform_fn may be None, the default is used as-is when the input key is missing
+    :return: CompiledMapping
+    """
+    return CompiledMapping(mapping_rules)
+
+
+# Function to map JSON keys based on provided rules
+# This function takes an input JSON and a set of mapping rules,
+# and returns a new JSON with keys transformed according to the rules.
+def map_json(input_data, mapping_rules):
+    """
+    Maps input JSON keys to a new JSON format based on mapping rules.
+    For repeated use with the same rules, compile_mapping(mapping_rules) once instead.
+
+    :param input_data: dict - incoming JSON
+    :param mapping_rules: dict - defines how input keys map to output keys
+                               - values can be strings (direct mapping)
+                               - or (output_key, transform_fn) tuples
+                               - see compile_mapping for nested keys and defaults
+    :return: dict - transformed output JSON
+    """
+    mapper = compile_mapping(mapping_rules)
+    output_data = mapper(input_data)
+    if mapper.missing:
+        print(
+            "Warning: input key(s) not found in input data: "
+            + ", ".join(f"'{key}'" for key in mapper.missing)
+        )
+    return output_data
+
+
+# *****************************************************
+# ** Address parsing **
+# The supplier address is the same on almost every invoice and customers come back,
+# so parsed addresses are cached. The key is the address with the whitespace around
+# the commas removed, which is all the parser looks at.
+_ADDRESS_FIELDS = ("streetname", "streetnumber", "box", "postalzone", "city", "country")
+_TEMPLATE_ADDRESS_FIELDS = ("streetname", "postalzone", "city", "country")
+_ADDRESS_TYPES = ("supplier", "customer")
+
+
+def _normalize_address(address):
+    return ",".join(part.strip() for part in address.split(","))
+
+
+def _split_postal_city(postal_city):
+    postal_parts = postal_city.split(" ", 1)
+    postalcode = postal_parts[0]
+    city = postal_parts[1] if len(postal_parts) > 1 else ""
+    return postalcode, city
+
+
+@lru_cache(maxsize=1024)
+def _parse_normalized_address(address):
+    parts = address.split(",")
+    street = nr = box = country = ""
+
+    # Handle country and postal/city
+    if len(parts) >= 3:
+        country = parts[-1]
+        postal_city_part = parts[-2]
+        remaining_parts = parts[:-2]
+    elif len(parts) == 2:
+        postal_city_part = parts[-1]
+        remaining_parts = parts[:-1]
+    else:
+        raise ValueError("Unexpected address format")
+
+    postalcode, city = _split_postal_city(postal_city_part)
+
+    # Look for box in remaining_parts, the last one wins
+    box_match = None
+    street_candidate = []
+    for part in remaining_parts:
+        match = _match_box(part)
+        if match:
+            box_match = match
+        else:
+            street_candidate.append(part)
+    if box_match:
+        box = box_match.group(1)
+
+    # Join street parts and extract street and number
+    street_match = _match_street(" ".join(street_candidate))
+    if street_match:
+        street = street_match.group(1).strip()
+        nr = street_match.group(2)
+        if not box and street_match.group(3):  # hyphen box as fallback
+            box = street_match.group(3)
+
+    return street, nr, box, postalcode, city, country
+
+
+@lru_cache(maxsize=1024)
+def _parse_normalized_template_address(address):
+    parts = address.split(",")
+    if len(parts) == 3:
+        street_and_nr, postal_city, country = parts
+    elif len(parts) == 2:
+        street_and_nr, postal_city = parts
+        country = ""  # fallback if country is missing
+    else:
+        raise ValueError("Unexpected address format")
+
+    postalcode, city = _split_postal_city(postal_city)
+    return street_and_nr, postalcode, city, country
+
+
+def _check_address_type(address_type):
+    if address_type not in _ADDRESS_TYPES:
+        raise ValueError(
+            "Invalid address type specified. Use 'supplier' or 'customer'."
+        )
+
+
+def parse_address(address):
+    """
+    Splits an address like "Kerkstraat 12, box 3, 2000 Antwerpen, Belgium" into its parts.
+
+    :param address: str - street and number, optional box, postal code and city, optional country
+    :return: dict with streetname, streetnumber, box, postalzone, city and country
+    """
+    return dict(zip(_ADDRESS_FIELDS, _parse_normalized_address(_normalize_address(address))))
+
+
+def parse_addresses(addresses):
+    """Batch version of parse_address, repeated addresses are parsed only once."""
+    return [parse_address(address) for address in addresses]
+
+
+def split_address_advanced(address, address_type):
+    parsed = _parse_normalized_address(_normalize_address(address))
+    _check_address_type(address_type)
+    prefix = f"P_{address_type}_address_"
+    return {prefix + field: value for field, value in zip(_ADDRESS_FIELDS, parsed)}
+
+
+def split_addresses_advanced(addresses, address_type):
+    """Batch version of split_address_advanced, repeated addresses are parsed only once."""
+    return [split_address_advanced(address, address_type) for address in addresses]
+
+
+def _split_address_for_template(address, address_type):
+    parsed = _parse_normalized_template_address(_normalize_address(address))
+    prefix = f"P_{address_type}_address_"
+    return {prefix + field: value for field, value in zip(_TEMPLATE_ADDRESS_FIELDS, parsed)}
+
+
+# Function to split supplier address into components
+# This function takes a supplier address string and splits it into street, postal code, city,
+# and country components. It returns a dictionary with these components.
+# If the address format is unexpected, it raises a ValueError.
+def split_supplier_address_for_template(address):
+    return _split_address_for_template(address, "supplier")
+
+
+def split_customer_address_for_template(address):
+    return _split_address_for_template(address, "customer")
@@ -36,6 +36,18 @@ class BillitOrderPDFTimeout(Exception):
     pass
 
 
+class AppSheetRejected(ExternalAPIError):
+    """Raised when AppSheet answered with an error status, the action was not applied."""
+
+    pass
+
+
+class BillitUnavailable(ExternalAPIError):
+    """Raised without calling Billit while its circuit breaker is open."""
+
+    pass
+
+
 # generic exception handler for Functions Framework
 # maps exceptions to (message, HTTP status code)
 # This is used to handle exceptions in a consistent way across the application.
@@ -91,6 +103,10 @@ def handle_exception(e):
         return (f"Internal operation timed out: {e}", 504)
 
     # --- Custom app-level errors ---
+    if isinstance(e, BillitUnavailable):
+        logging.error(f"Billit unavailable: {e}")
+        return (f"{e}", 503)
+
     if isinstance(e, ExternalAPIError):
         logging.error(f"AppSheet/External API error: {e}")
         return (f"{e}", 502)  # propagate the exact message you raised
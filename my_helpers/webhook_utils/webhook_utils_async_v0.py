@@ -0,0 +1,218 @@
+# webhook_utils_async_v0.py
+# asyncio version of post_data_to_appsheet, to run independent table actions of a webhook
+# (e.g. Find on Customers and Find on Products) concurrently instead of one after the other
+# created 20261017
+# requires aiohttp (pip install my-helpers[async])
+# 20261017: identical Finds in flight at the same time share one HTTP call (AsyncSingleFlight)
+
+import asyncio
+import json
+from collections import Counter
+
+import aiohttp
+
+from my_helpers.exceptions.exceptions_v0 import AppSheetRejected, ExternalAPIError
+from my_helpers.webhook_utils.webhook_utils_v7 import (
+    AppSheetFindCache,
+    build_appsheet_payload,
+    check_mandatory_args,
+    get_url,
+)
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight: tasks asking for the same key at the same time share
+    one run of the coroutine. The run is a task of its own, cancelling one waiting caller
+    does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> asyncio.Task
+
+    async def do(self, key, coroutine_fn):
+        """
+        :return: tuple (result of the coroutine, True for the caller that started it)
+        :raises: the exception raised by the coroutine, in every waiting caller
+        """
+        task = self._flights.get(key)
+        leader = task is None
+        if leader:
+            task = self._flights[key] = asyncio.ensure_future(coroutine_fn())
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        return await asyncio.shield(task), leader
+
+
+class AsyncAppSheetClient:
+    """
+    asyncio AppSheet API client on aiohttp for one app, use it as an async context manager.
+    Builds the same payload and retries the same way as post_data_to_appsheet.
+
+    :param app_id: str - AppSheet app id
+    :param app_access_key: str - AppSheet application access key
+    :param concurrency: maximum number of calls in flight to this app, AppSheet throttles above a few
+    :param timeout_seconds: read timeout per call
+    :param max_retries: attempts per call on connection errors / timeouts
+    :param find_cache: AppSheetFindCache for Find actions, can be shared with the sync client
+    :param coalesce: identical Finds in flight at the same time share one call
+    """
+
+    def __init__(
+        self,
+        app_id,
+        app_access_key,
+        concurrency=4,
+        timeout_seconds=120,
+        max_retries=3,
+        find_cache=None,
+        coalesce=True,
+    ):
+        check_mandatory_args({"app_id": app_id, "app_access_key": app_access_key})
+        self.app_id = app_id
+        self.app_access_key = app_access_key
+        self.concurrency = concurrency
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.find_cache = find_cache
+        self.single_flight = AsyncSingleFlight() if coalesce else None
+        self._writes = Counter()  # table -> number of writes, part of the single-flight key
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(connect=15, sock_read=self.timeout_seconds),
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def post(self, table, rows, action, selector=None, user_settings=None):
+        """
+        Calls an action on an AppSheet table, retries connection errors with exponential backoff.
+        :return: dict - the JSON returned by AppSheet (post_data_to_appsheet returns the Response)
+        """
+        check_mandatory_args({"table": table, "rows": rows, "action": action})
+        # ✓ Fix rows=None edge case
+        if rows == [None]:
+            rows = []
+
+        url_appsheet_app = get_url(table, self.app_id, self.app_access_key)
+
+        cache = self.find_cache
+        payload = build_appsheet_payload(action, rows, selector, user_settings)
+
+        if action != "Find":
+            # the table changes: its cached Finds are stale, Finds in flight are not joined
+            # anymore, and again after the write for Finds that started while it was in flight
+            self._table_written(table)
+            try:
+                return json.loads(await self._send(table, url_appsheet_app, payload))
+            finally:
+                self._table_written(table)
+
+        find_key = AppSheetFindCache.key(self.app_id, table, selector, rows, user_settings)
+        generation = None
+        if cache is not None:
+            body = cache.get(find_key)
+            if body is not None:
+                print(f"Find on AppSheet table {table} served from cache.")
+                return json.loads(body)
+            generation = cache.generation(self.app_id, table)
+
+        async def send_find():
+            text = await self._send(table, url_appsheet_app, payload)
+            # only the caller that made the call caches, with the generation read before it
+            if cache is not None:
+                cache.put(find_key, text.encode(), generation)
+            return text
+
+        if self.single_flight is None:
+            text = await send_find()
+        else:
+            # a Find only joins a flight that started after the latest write to the table
+            flight_key = (find_key, generation, self._writes[table])
+            text, leader = await self.single_flight.do(flight_key, send_find)
+            if not leader:
+                print(f"Find on AppSheet table {table} shared with an identical call in flight.")
+        # parsed per caller, callers that share a call do not share the dict
+        return json.loads(text)
+
+    def _table_written(self, table):
+        self._writes[table] += 1
+        if self.find_cache is not None:
+            self.find_cache.invalidate_table(self.app_id, table)
+
+    async def _send(self, table, url_appsheet_app, payload):
+        """Posts the payload with retries, returns the response text."""
+        print("JSON FOR APPSHEET", json.dumps(payload, indent=2))
+
+        async with self._semaphore:
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    print(f"📡 Calling AppSheet {table} (attempt {attempt}/{self.max_retries})...")
+                    async with self.session.post(url_appsheet_app, json=payload) as response:
+                        text = await response.text()
+                        if response.status != 200:
+                            raise AppSheetRejected(
+                                f"Failed posting to AppSheet table {table}. "
+                                f"Status={response.status} | Response={text}"
+                            )
+                        if not text.strip():
+                            raise ExternalAPIError(
+                                f"No data returned from AppSheet, table={table}"
+                            )
+                        print(f"Data posted to AppSheet table {table} successfully.")
+                        return text
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+                    print(
+                        f"⚠️ Request error on attempt {attempt}/{self.max_retries}: {req_err!r}"
+                    )
+
+                # Retry with exponential backoff
+                if attempt < self.max_retries:
+                    wait = 2 ** (attempt - 1)
+                    print(f"🔁 Retrying in {wait} s...")
+                    await asyncio.sleep(wait)
+
+        raise ExternalAPIError(
+            f"AppSheet unreachable after {self.max_retries} attempts for table {table}"
+        )
+
+    async def gather(self, actions, return_exceptions=False):
+        """
+        Runs independent table actions concurrently (at most `concurrency` in flight).
+
+        :param actions: list of dicts with the arguments of post, e.g.
+                        {"table": "Customers", "rows": [], "action": "Find", "selector": "..."}
+        :return: list of AppSheet JSON responses, in the order of actions
+        """
+        return await asyncio.gather(
+            *(self.post(**action) for action in actions),
+            return_exceptions=return_exceptions,
+        )
+
+
+# --- Synchronous entry point for webhooks ---
+def post_data_to_appsheet_many(
+    actions, app_id, app_access_key, concurrency=4, timeout_seconds=120, max_retries=3
+):
+    """
+    Runs independent AppSheet table actions concurrently from synchronous code,
+    the webhook then waits for the slowest call instead of the sum of all calls.
+    See AsyncAppSheetClient.gather.
+    """
+
+    async def run():
+        async with AsyncAppSheetClient(
+            app_id, app_access_key, concurrency, timeout_seconds, max_retries
+        ) as client:
+            return await client.gather(actions)
+
+    return asyncio.run(run())
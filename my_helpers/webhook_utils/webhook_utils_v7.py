@@ -0,0 +1,597 @@
+# WEBHOOK_UTILS_7
+# ********************************************************************************************************************************************
+# THIS SET OF HELPER FUNCTIONS IS ABOUT HTTPS CALLERS TO OTHER SYSTEMS
+#
+# Created by Marc De Krock
+# 20250904: for reading a record, the row=None was not handled correctly, this is now fixed by     if rows == [None]: and not... if rows is None:
+# 20251113: added retries + increased default timeout from 30 to 120 seconds
+# 20261017: added post_data_to_appsheet_bulk, large Add / Edit syncs in size- and byte-bounded chunks sent concurrently
+# 20261017: added AppSheetClient, one pooled keep-alive session per app_id instead of a new TLS connection
+#           per call, post_data_to_appsheet is now a wrapper over the shared client
+# 20261017: added AppSheetFindCache / enable_appsheet_find_cache, Find results are served from memory
+#           until their TTL, any other action on the table drops its cached Finds
+# 20261017: identical Finds in flight at the same time share one HTTP call (SingleFlight)
+# ********************************************************************************************************************************************
+
+import requests
+import urllib.parse
+import threading
+import time
+import json
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from flask import jsonify
+from my_helpers.exceptions.exceptions_v0 import (
+    AppSheetRejected,
+    ExternalAPIError,
+    MethodNotAllowedError,
+    BadRequestError,
+    BusinessRuleError,
+)
+from requests.exceptions import SSLError, RequestException
+
+
+# *
+def send_push_notification(message, api_key=None, device_id=None):
+    url = f"https://www.pushsafer.com/api?k={api_key}&d={device_id}&m={message}"
+    print("XXXXXXXXXXXXXX URL PUSH: ", url)
+    response = requests.get(url)
+
+    if response.status_code == 200:
+        return "Notification sent successfully!"
+    else:
+        return f"Failed to send notification. Status code: {response.status_code}, Response: {response.text}"
+
+
+# **********************************************************
+@lru_cache(maxsize=512)
+def get_url(table, app_id=None, app_access_key=None):
+    encoded_table = urllib.parse.quote(table)
+    appsheet_url = f"https://api.appsheet.com/api/v2/apps/{app_id}/tables/{encoded_table}/Action?applicationAccessKey={app_access_key}"
+    return appsheet_url
+
+
+# **********************************************************
+# Post data to AppSheet generic helper function
+# changes made on 2025-08-22 by Marc De Krock
+#   improved error handling
+#   added parameter checks and informative error messages by a raising ExternalAPIError
+# **********************************************************
+def check_mandatory_args_1(args: dict):  # only when 'None' is not allowed
+    """
+    Checks that all mandatory function arguments are provided (not None).
+    Empty lists/dicts are considered valid if explicitly passed.
+    """
+    missing = [k for k, v in args.items() if v is None]
+    if missing:
+        msg = f"Mandatory function argument(s) missing: {', '.join(missing)}"
+        raise ExternalAPIError(msg)
+
+
+def check_mandatory_args(
+    args: dict,
+):  # when both 'None' and empty string are not allowed
+    missing = [k for k, v in args.items() if v in (None, "")]
+    if missing:
+        msg = f"Mandatory function argument(s) missing: {', '.join(missing)}"
+        raise ExternalAPIError(msg)
+
+
+def build_appsheet_payload(action, rows, selector=None, user_settings=None):
+    """Builds the body of an AppSheet API Action call."""
+    payload = {
+        "Action": action,
+        "Properties": {
+            "Locale": "en-US",
+            "Location": "51.159133, 4.806236",
+            "Timezone": "Central European Standard Time",
+        },
+        "Rows": rows,
+    }
+
+    if selector:
+        payload["Properties"]["Selector"] = selector
+    if user_settings:
+        payload["Properties"]["UserSettings"] = user_settings
+    return payload
+
+
+# **********************************************************
+# Find cache
+# Reference lookups (customers, VAT rates, products) are the same on every webhook.
+# A Find is cached by app, table, selector, rows and user settings until its TTL, Add / Edit /
+# Delete (or any other action) on the same table drops the cached Finds of that table.
+# **********************************************************
+class AppSheetFindCache:
+    """
+    LRU cache with TTL for the responses of AppSheet Find actions.
+
+    :param max_items: maximum number of cached Finds
+    :param ttl: seconds a Find is served from the cache
+    """
+
+    def __init__(self, max_items=512, ttl=300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (expires, response body)
+        self._generations = {}  # (app_id, table) -> counter, bumped by every invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(app_id, table, selector=None, rows=None, user_settings=None):
+        return (
+            app_id,
+            table,
+            selector,
+            json.dumps(rows, sort_keys=True, default=str),
+            json.dumps(user_settings, sort_keys=True, default=str),
+        )
+
+    def generation(self, app_id, table):
+        with self._lock:
+            return self._generations.get((app_id, table), 0)
+
+    def get(self, key):
+        """Returns the cached response body (bytes), or None."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._items.pop(key, None)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, body, generation):
+        """
+        Caches a Find response. generation is the table's generation from before the call:
+        when the table was written to meanwhile, the (possibly stale) response is not cached.
+        """
+        with self._lock:
+            if self._generations.get(key[:2], 0) != generation:
+                return
+            self._items[key] = (time.monotonic() + self.ttl, body)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def invalidate_table(self, app_id, table):
+        with self._lock:
+            self._generations[(app_id, table)] = self._generations.get((app_id, table), 0) + 1
+            for key in [key for key in self._items if key[:2] == (app_id, table)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+def _response_from_cache(body, url):
+    """A requests.Response for a cached Find, so callers use .json() / .text as usual."""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.encoding = "utf-8"
+    response.headers["Content-Type"] = "application/json"
+    response.url = url
+    return response
+
+
+# **********************************************************
+# Request coalescing
+# During a burst of webhooks many threads issue the same Find at the same moment. With
+# SingleFlight the first caller (the leader) makes the call, the others wait for it and get
+# its result or its exception. Only Finds are coalesced: two identical Adds are two rows.
+# **********************************************************
+class SingleFlight:
+    """Runs fn once per key for all threads that ask for the same key at the same time."""
+
+    def __init__(self):
+        self._flights = {}  # key -> [threading.Event, result, exception]
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        :return: tuple (result of fn, True for the caller that ran fn)
+        :raises: the exception raised by fn, in every waiting caller
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = [threading.Event(), None, None]
+
+        if not leader:
+            flight[0].wait()
+            if flight[2] is not None:
+                raise flight[2]
+            return flight[1], False
+
+        try:
+            flight[1] = fn()
+            return flight[1], True
+        except BaseException as e:
+            flight[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight[0].set()
+
+
+# **********************************************************
+# AppSheet client
+# requests.post opens a new TLS connection to api.appsheet.com on every call and every retry.
+# AppSheetClient keeps one requests.Session per app, its connections stay open between calls.
+# **********************************************************
+class AppSheetClient:
+    """
+    AppSheet API client with a pooled keep-alive session.
+
+    :param app_id: str - AppSheet app id
+    :param app_access_key: str - AppSheet application access key
+    :param pool_maxsize: connections kept alive (one per concurrent caller)
+    :param find_cache: AppSheetFindCache for Find actions (None for no caching)
+    :param coalesce: identical Finds in flight at the same time share one call
+    """
+
+    def __init__(
+        self, app_id, app_access_key, pool_maxsize=16, find_cache=None, coalesce=True
+    ):
+        check_mandatory_args({"app_id": app_id, "app_access_key": app_access_key})
+        self.app_id = app_id
+        self.app_access_key = app_access_key
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.find_cache = find_cache
+        self.single_flight = SingleFlight() if coalesce else None
+        self._writes = Counter()  # table -> number of writes, part of the single-flight key
+        self._writes_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def url(self, table):
+        return get_url(table, self.app_id, self.app_access_key)
+
+    def post(
+        self,
+        table,
+        rows,
+        action,
+        selector=None,
+        user_settings=None,
+        timeout_seconds=120,
+        max_retries=3,
+    ):
+        """
+        Calls an action on an AppSheet table, retries connection errors with exponential backoff.
+        :return: requests.Response
+        """
+        # ✓ Fix rows=None edge case
+        if rows == [None]:
+            rows = []
+
+        url_appsheet_app = self.url(table)
+        print("URL:", url_appsheet_app)
+
+        cache = self.find_cache
+        payload = build_appsheet_payload(action, rows, selector, user_settings)
+
+        def send():
+            return self._send(table, url_appsheet_app, payload, timeout_seconds, max_retries)
+
+        if action != "Find":
+            # the table changes: its cached Finds are stale, Finds in flight are not joined
+            # anymore, and again after the write for Finds that started while it was in flight
+            self._table_written(table)
+            try:
+                return send()
+            finally:
+                self._table_written(table)
+
+        find_key = AppSheetFindCache.key(self.app_id, table, selector, rows, user_settings)
+        generation = None
+        if cache is not None:
+            body = cache.get(find_key)
+            if body is not None:
+                print(f"Find on AppSheet table {table} served from cache.")
+                return _response_from_cache(body, url_appsheet_app)
+            generation = cache.generation(self.app_id, table)
+
+        def send_find():
+            appsheet_response = send()
+            # only the caller that made the call caches, with the generation read before it
+            if cache is not None:
+                cache.put(find_key, appsheet_response.content, generation)
+            return appsheet_response
+
+        if self.single_flight is None:
+            return send_find()
+
+        # a Find only joins a flight that started after the latest write to the table
+        with self._writes_lock:
+            flight_key = (find_key, generation, self._writes[table])
+        appsheet_response, leader = self.single_flight.do(flight_key, send_find)
+        if not leader:
+            print(f"Find on AppSheet table {table} shared with an identical call in flight.")
+            # every caller gets its own Response object
+            appsheet_response = _response_from_cache(
+                appsheet_response.content, url_appsheet_app
+            )
+        return appsheet_response
+
+    def _table_written(self, table):
+        with self._writes_lock:
+            self._writes[table] += 1
+        if self.find_cache is not None:
+            self.find_cache.invalidate_table(self.app_id, table)
+
+    def _send(self, table, url_appsheet_app, payload, timeout_seconds, max_retries):
+        print("JSON FOR APPSHEET", json.dumps(payload, indent=2))
+
+        # ─────────────────────────────────────────────
+        #   RETRIES to avoid SSLEOFError & timeouts
+        # ─────────────────────────────────────────────
+        attempt = 1
+        while attempt <= max_retries:
+            try:
+                print(f"📡 Calling AppSheet (attempt {attempt}/{max_retries})...")
+
+                appsheet_response = self.session.post(
+                    url_appsheet_app,
+                    json=payload,
+                    timeout=(15, timeout_seconds),
+                    # (connect timeout, read timeout)
+                )
+
+                # ✓ Success path
+                if appsheet_response.status_code == 200:
+                    if not appsheet_response.text.strip():
+                        raise ExternalAPIError(
+                            f"No data returned from AppSheet, table={table}"
+                        )
+                    print(f"Data posted to AppSheet table {table} successfully.")
+                    return appsheet_response
+
+                # Non-200 → error
+                raise AppSheetRejected(
+                    f"Failed posting to AppSheet table {table}. "
+                    f"Status={appsheet_response.status_code} | Response={appsheet_response.text}"
+                )
+
+            except SSLError as ssl_err:
+                print(
+                    f"⚠️ SSL/Connection issue on attempt {attempt}/{max_retries}: {ssl_err}"
+                )
+
+            except RequestException as req_err:
+                print(f"⚠️ Request error on attempt {attempt}/{max_retries}: {req_err}")
+
+            # Retry with exponential backoff
+            if attempt < max_retries:
+                wait = 2 ** (attempt - 1)
+                print(f"🔁 Retrying in {wait} s...")
+                time.sleep(wait)
+
+            attempt += 1
+
+        # ───────────────────────────────
+        # If we reach here → total failure
+        # ───────────────────────────────
+        raise ExternalAPIError(
+            f"AppSheet unreachable after {max_retries} attempts for table {table}"
+        )
+
+
+_appsheet_clients = {}
+_appsheet_clients_lock = threading.Lock()
+
+
+def get_appsheet_client(app_id, app_access_key):
+    """Returns the shared AppSheetClient for this app."""
+    key = (app_id, app_access_key)
+    client = _appsheet_clients.get(key)
+    if client is None:
+        with _appsheet_clients_lock:
+            client = _appsheet_clients.get(key)
+            if client is None:
+                client = _appsheet_clients[key] = AppSheetClient(app_id, app_access_key)
+    return client
+
+
+def enable_appsheet_find_cache(app_id, app_access_key, max_items=512, ttl=300):
+    """
+    Caches the Find actions of post_data_to_appsheet for this app, see AppSheetFindCache.
+    Only writes made through post_data_to_appsheet (or the same client) invalidate the cache,
+    changes made in the app itself show up after the TTL.
+    :return: AppSheetFindCache
+    """
+    cache = AppSheetFindCache(max_items, ttl)
+    get_appsheet_client(app_id, app_access_key).find_cache = cache
+    return cache
+
+
+def post_data_to_appsheet(
+    table=None,
+    rows=None,
+    action=None,
+    selector=None,
+    app_name=None,
+    app_id=None,
+    app_access_key=None,
+    user_settings=None,
+    timeout_seconds=120,  # ⬅️ main fix
+    max_retries=3,  # ⬅️ retry AppSheet slowness
+):
+
+    print("In post_data_to_appsheet")
+    print("Table:", table)
+    print("Rows:", rows)
+    print("Action:", action)
+    print("Selector:", selector)
+    print("App Name:", app_name)
+    print("App ID:", app_id)
+    print("App Access Key:", app_access_key)
+    print("User Settings:", user_settings)
+
+    # ✓ Mandatory args
+    mandatory_args = {
+        "table": table,
+        "rows": rows,
+        "action": action,
+        "app_name": app_name,
+        "app_id": app_id,
+        "app_access_key": app_access_key,
+    }
+    check_mandatory_args(mandatory_args)
+
+    print("All mandatory arguments are provided ✅")
+
+    return get_appsheet_client(app_id, app_access_key).post(
+        table,
+        rows,
+        action,
+        selector=selector,
+        user_settings=user_settings,
+        timeout_seconds=timeout_seconds,
+        max_retries=max_retries,
+    )
+
+
+# **********************************************************
+# Bulk writer for large Add / Edit / Delete syncs
+# One request with thousands of rows runs into the read timeout, so the rows are split in
+# chunks of at most chunk_rows rows and chunk_bytes bytes of JSON, the chunks are posted
+# concurrently (at most `concurrency` at a time) and a chunk that AppSheet rejected is retried
+# on its own. A chunk without answer (timeouts) may have been written and is never posted again.
+# **********************************************************
+def split_rows_in_chunks(rows, chunk_rows=500, chunk_bytes=1_000_000):
+    """
+    Splits rows in chunks of at most chunk_rows rows and (about) chunk_bytes bytes of JSON.
+    A single row larger than chunk_bytes gets a chunk of its own.
+    """
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for row in rows:
+        row_size = len(json.dumps(row).encode()) + 1  # + separator
+        if chunk and (len(chunk) >= chunk_rows or chunk_size + row_size > chunk_bytes):
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+        chunk.append(row)
+        chunk_size += row_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def post_data_to_appsheet_bulk(
+    table=None,
+    rows=None,
+    action=None,
+    selector=None,
+    app_name=None,
+    app_id=None,
+    app_access_key=None,
+    user_settings=None,
+    chunk_rows=500,
+    chunk_bytes=1_000_000,
+    concurrency=4,
+    chunk_retries=2,
+    timeout_seconds=120,
+    max_retries=3,
+):
+    """
+    Posts many rows to an AppSheet table in concurrent chunks, see post_data_to_appsheet.
+
+    :param chunk_rows: maximum number of rows per request
+    :param chunk_bytes: maximum JSON size of the rows per request
+    :param concurrency: maximum number of requests in flight
+    :param chunk_retries: extra attempts for a chunk that AppSheet answered with an error
+                          (connection errors are already retried by post_data_to_appsheet)
+    :return: list - the rows returned by AppSheet, in the order of the chunks
+    :raises ExternalAPIError: when chunks fail, with the attributes
+                              .rows - rows returned for the chunks that succeeded
+                              .failed_rows - rows of the chunks AppSheet rejected, not written
+                              .unknown_rows - rows of the chunks AppSheet did not answer
+                              (timeouts), they may have been written: check before resubmitting
+    """
+    check_mandatory_args({"table": table, "rows": rows, "action": action})
+    chunks = split_rows_in_chunks(rows, chunk_rows, chunk_bytes)
+    print(f"Posting {len(rows)} rows to AppSheet table {table} in {len(chunks)} chunks")
+
+    def post_chunk(chunk):
+        for attempt in range(chunk_retries + 1):
+            try:
+                response = post_data_to_appsheet(
+                    table=table,
+                    rows=chunk,
+                    action=action,
+                    selector=selector,
+                    app_name=app_name,
+                    app_id=app_id,
+                    app_access_key=app_access_key,
+                    user_settings=user_settings,
+                    timeout_seconds=timeout_seconds,
+                    max_retries=max_retries,
+                )
+                return response.json().get("Rows", [])
+            except AppSheetRejected as e:
+                # AppSheet answered with an error, the chunk was not written
+                if attempt == chunk_retries:
+                    raise
+                print(f"⚠️ Chunk of {len(chunk)} rows failed ({e}), retrying...")
+                time.sleep(2**attempt)
+
+    results = [None] * len(chunks)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(post_chunk, chunk): index for index, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                errors[index] = e
+
+    merged_rows = [row for result in results if result for row in result]
+    if errors:
+        error = ExternalAPIError(
+            f"{len(errors)} of {len(chunks)} chunks failed posting to AppSheet table {table}: "
+            + "; ".join(f"chunk {index}: {errors[index]}" for index in sorted(errors))
+        )
+        error.rows = merged_rows
+        error.failed_rows = [
+            row
+            for index in sorted(errors)
+            if isinstance(errors[index], AppSheetRejected)
+            for row in chunks[index]
+        ]
+        error.unknown_rows = [
+            row
+            for index in sorted(errors)
+            if not isinstance(errors[index], AppSheetRejected)
+            for row in chunks[index]
+        ]
+        raise error
+
+    print(f"{len(rows)} rows posted to AppSheet table {table} in {len(chunks)} chunks ✅")
+    return merged_rows
@@ -0,0 +1,57 @@
+"""
+Micro-benchmark for the leaf matchers of my_helpers.data_processing_utils
+Compares the per-leaf cost of the v1 cleaners (re.match / re.fullmatch with literal patterns)
+with the v2 cleaners (precompiled patterns from LEAF_MATCHERS with a first-character prefilter)
+"""
+
+import timeit
+
+from my_helpers.data_processing_utils import data_procesing_utils_v1 as v1
+from my_helpers.data_processing_utils import data_procesing_utils_v2 as v2
+
+# Typical string leaves of an invoice payload, most of them are not money / VAT / numbers
+LEAVES = [
+    "Consulting services",
+    "ACME Corporation",
+    "Kerkstraat 12, 2000 Antwerpen, Belgium",
+    "info@example.com",
+    "EUR",
+    "Peppol",
+    "€1,752.66",
+    "21%",
+    "12.50",
+    "3",
+]
+
+CLEANERS = [
+    ("clean_money_in_json", v1.clean_money_in_json, v2.clean_money_value),
+    ("clean_vat_in_json", v1.clean_vat_in_json, v2.clean_vat_value),
+    ("convert_numeric_strings", v1.convert_numeric_strings, v2.convert_numeric_string),
+]
+
+
+def per_leaf_ns(fn, number):
+    seconds = timeit.timeit(lambda: [fn(leaf) for leaf in LEAVES], number=number)
+    return seconds / (number * len(LEAVES)) * 1e9
+
+
+def run_benchmark(number=20000):
+    """Print the per-leaf cost of every cleaner before (v1) and after (v2)"""
+    print("=" * 60)
+    print("PER-LEAF COST (ns)")
+    print("=" * 60)
+    print(f"{'cleaner':<28}{'before':>10}{'after':>10}{'speedup':>10}")
+    for name, before_fn, after_fn in CLEANERS:
+        before = per_leaf_ns(before_fn, number)
+        after = per_leaf_ns(after_fn, number)
+        print(f"{name:<28}{before:>10.0f}{after:>10.0f}{before / after:>9.1f}x")
+
+    address = "Kerkstraat 12, box 3, 2000 Antwerpen, Belgium"
+    before = timeit.timeit(lambda: v1.split_address_advanced(address, "supplier"), number=number)
+    after = timeit.timeit(lambda: v2.split_address_advanced(address, "supplier"), number=number)
+    before, after = before / number * 1e9, after / number * 1e9
+    print(f"{'split_address_advanced':<28}{before:>10.0f}{after:>10.0f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    run_benchmark()
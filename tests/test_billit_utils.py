@@ -0,0 +1,670 @@
+"""
+Tests for my_helpers.billit_utils.billit_utils_v4
+The Billit API is replaced by a fake requests session, no network calls are made
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from my_helpers.billit_utils import billit_utils_async_v0 as billit_async
+from my_helpers.billit_utils import billit_utils_v4 as billit
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"{}"):
+        self.status_code = status_code
+        self.content = body
+        self.text = body.decode()
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code}", response=self)
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Answers every request with answer(method, url, json), records the requests"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+
+    def request(self, method, url, headers=None, json=None, **kwargs):
+        self.requests.append((method, url, dict(headers or {}), json))
+        result = self.answer(method, url, json)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def make_client(answer, **kwargs):
+    client = billit.BillitClient("KEY", "https://billit.test", retry_backoff=0, **kwargs)
+    client.session = FakeSession(answer)
+    return client
+
+
+def sent_ids(client):
+    return [request[3]["OrderIDs"] for request in client.session.requests]
+
+
+# **********************************************************
+# send_orders
+# **********************************************************
+def test_send_orders_one_call_per_chunk():
+    client = make_client(lambda method, url, body: FakeResponse(200))
+    results = client.send_orders(list(range(10)), "Peppol", chunk_size=4)
+    assert sent_ids(client) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert all(result["status"] == "sent" for result in results.values())
+    assert sorted(results) == list(range(10))
+
+
+def test_send_orders_splits_rejected_chunk():
+    def answer(method, url, body):
+        return FakeResponse(400, b"rejected") if 3 in body["OrderIDs"] else FakeResponse(200)
+
+    client = make_client(answer)
+    results = client.send_orders([1, 2, 3, 4], "Peppol", chunk_size=4)
+    assert results[3]["status"] == "failed"
+    assert [results[i]["status"] for i in (1, 2, 4)] == ["sent"] * 3
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        lambda method, url, body: requests.exceptions.ReadTimeout("read timed out"),
+        lambda method, url, body: FakeResponse(502, b"bad gateway"),
+        lambda method, url, body: FakeResponse(500, b"error"),
+    ],
+)
+def test_send_orders_never_resends_a_chunk_that_may_have_arrived(answer):
+    client = make_client(answer, max_retries=0)
+    results = client.send_orders([1, 2, 3, 4], "Peppol", chunk_size=4)
+    assert sent_ids(client) == [[1, 2, 3, 4]]
+    assert all(result["status"] == "unknown" for result in results.values())
+    assert not any(result["success"] for result in results.values())
+
+
+def test_send_orders_idempotency_key_per_call_and_reused_on_retry():
+    answers = iter([FakeResponse(429), FakeResponse(200), FakeResponse(200)])
+    client = make_client(lambda method, url, body: next(answers))
+    client.send_orders([1, 2], "Peppol")
+    client.send_orders([1, 2], "Peppol")  # e.g. sending an invoice again
+    keys = [request[2]["Idempotency-Key"] for request in client.session.requests]
+    assert len(keys) == 3
+    assert keys[0] == keys[1] != keys[2]
+
+
+def test_send_orders_invalid_transport_type():
+    client = make_client(lambda method, url, body: FakeResponse(200))
+    with pytest.raises(ValueError):
+        client.send_orders([1], "Pigeon")
+    assert client.session.requests == []
+
+
+# **********************************************************
+# CircuitBreaker
+# **********************************************************
+def test_circuit_breaker_opens_after_threshold():
+    breaker = billit.CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_success()  # a success resets the count
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    with pytest.raises(billit.BillitUnavailable):
+        breaker.before_call()
+
+
+def test_circuit_breaker_half_open_lets_one_trial_through():
+    breaker = billit.CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    with pytest.raises(billit.BillitUnavailable):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()  # the trial
+    with pytest.raises(billit.BillitUnavailable):
+        breaker.before_call()  # no second call while the trial runs
+    breaker.record_failure()  # failed trial: open for another reset_timeout
+    with pytest.raises(billit.BillitUnavailable):
+        breaker.before_call()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()  # successful trial closes the breaker
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_client_fails_fast_while_billit_is_down():
+    client = make_client(
+        lambda method, url, body: FakeResponse(503, b"down"),
+        max_retries=0,
+        failure_threshold=2,
+    )
+    for _ in range(2):
+        assert client._request("GET", "https://billit.test/v1/orders/1").status_code == 503
+    with pytest.raises(billit.BillitUnavailable):
+        client._request("GET", "https://billit.test/v1/orders/1")
+    assert len(client.session.requests) == 2
+
+
+def test_client_counts_connection_errors_and_4xx_is_not_a_failure():
+    errors = iter([requests.exceptions.ConnectionError("refused"), FakeResponse(404)])
+    client = make_client(lambda method, url, body: next(errors), max_retries=0, failure_threshold=2)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client._request("GET", "https://billit.test/v1/orders/1")
+    assert client.circuit_breaker.failures == 1
+    assert client._request("GET", "https://billit.test/v1/orders/1").status_code == 404
+    assert client.circuit_breaker.failures == 0
+
+
+@pytest.mark.parametrize(
+    "retry_after, calls, status_code",
+    [("0", 2, 200), ("3600", 1, 429), ("Wed, 21 Oct 2026 07:28:00 GMT", 2, 200)],
+)
+def test_client_retry_after_is_bounded_by_the_read_timeout(monkeypatch, retry_after, calls, status_code):
+    sleeps = []
+    monkeypatch.setattr(billit.time, "sleep", sleeps.append)
+    answers = iter([FakeResponse(429), FakeResponse(200)])
+
+    def answer(method, url, body):
+        response = next(answers)
+        response.headers["Retry-After"] = retry_after
+        return response
+
+    client = make_client(answer, read_timeout=60)
+    response = client._request("GET", "https://billit.test/v1/orders/1")
+    assert response.status_code == status_code
+    assert len(client.session.requests) == calls
+    assert all(seconds <= 60 for seconds in sleeps)
+
+
+def test_shared_clients_of_one_api_key_share_breaker_and_session(monkeypatch):
+    monkeypatch.setattr(billit, "_billit_clients", {})
+    without_url = billit.get_billit_client("KEY")
+    with_url = billit.get_billit_client("KEY", "https://billit.test")
+    other_key = billit.get_billit_client("OTHER", "https://billit.test")
+    assert without_url is not with_url
+    assert with_url.base_url == "https://billit.test" and without_url.base_url is None
+    assert without_url.circuit_breaker is with_url.circuit_breaker
+    assert without_url.session is with_url.session
+    assert without_url.pdf_wait is with_url.pdf_wait
+    assert other_key.circuit_breaker is not with_url.circuit_breaker
+    assert other_key.session is not with_url.session
+
+    for _ in range(with_url.circuit_breaker.failure_threshold):
+        with_url.circuit_breaker.record_failure()
+    with pytest.raises(billit.BillitUnavailable):
+        without_url.get_order(1, "https://billit.test/v1/orders")
+    other_key.circuit_breaker.before_call()
+
+
+# **********************************************************
+# AsyncBillitClient
+# **********************************************************
+@pytest.mark.parametrize("retry_after", ["0", "Wed, 21 Oct 2026 07:28:00 GMT"])
+def test_async_client_retries_429_with_any_retry_after(monkeypatch, retry_after):
+    web = pytest.importorskip("aiohttp.web")
+    from aiohttp.test_utils import TestServer
+
+    sleep = asyncio.sleep
+    monkeypatch.setattr(billit_async.asyncio, "sleep", lambda seconds: sleep(0))
+    calls = []
+
+    async def order(request):
+        calls.append(request.match_info["order_id"])
+        if len(calls) == 1:
+            return web.Response(status=429, headers={"Retry-After": retry_after})
+        return web.json_response({"OrderID": 1})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/v1/orders/{order_id}", order)
+        async with TestServer(app) as server:
+            base_url = str(server.make_url("")).rstrip("/")
+            async with billit_async.AsyncBillitClient("KEY", base_url, rate_limit=None) as client:
+                return await client.get_order_details(1)
+
+    assert asyncio.run(run()) == {"OrderID": 1}
+    assert calls == ["1", "1"]
+
+
+# **********************************************************
+# BillitCache
+# **********************************************************
+def test_cache_disk_tier_survives_a_new_cache(tmp_path):
+    cache = billit.BillitCache(disk_dir=str(tmp_path))
+    cache.put_file("F1", {"FileName": "a.pdf"})
+    cache.put_order(7, {"OrderID": 7})
+    other = billit.BillitCache(disk_dir=str(tmp_path))
+    assert other.get_file("F1") == {"FileName": "a.pdf"}
+    assert other.get_order(7) == {"OrderID": 7}
+
+
+def test_cache_concurrent_writers_of_one_key(tmp_path):
+    cache = billit.BillitCache(disk_dir=str(tmp_path))
+    with ThreadPoolExecutor(8) as executor:
+        for future in [
+            executor.submit(cache.put_order, 7, {"OrderID": 7, "Writer": i}) for i in range(200)
+        ]:
+            future.result()
+    cache.clear()
+    assert cache.get_order(7)["OrderID"] == 7
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".part")] == []
+
+
+def test_cache_invalidate_twice_and_concurrently(tmp_path):
+    cache = billit.BillitCache(disk_dir=str(tmp_path))
+    cache.put_order(7, {"OrderID": 7})
+    with ThreadPoolExecutor(8) as executor:
+        for future in [executor.submit(cache.invalidate_order, 7) for _ in range(50)]:
+            future.result()
+    cache.invalidate_order(7)
+    assert cache.get_order(7) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_cache_keeps_working_when_the_disk_fails(tmp_path):
+    cache = billit.BillitCache(disk_dir=str(tmp_path / "cache"))
+    shutil.rmtree(tmp_path / "cache")
+    cache.put_order(7, {"OrderID": 7})
+    assert cache.get_order(7) == {"OrderID": 7}
+
+
+# **********************************************************
+# BillitOrder / BillitOrderLine
+# **********************************************************
+ORDER = {
+    "OrderID": 7,
+    "OrderNumber": "INV-7",
+    "Paid": None,
+    "Reference": None,
+    "OrderLines": [{"Description": "Coffee", "Quantity": 2, "VATPercentage": None}],
+    "OrderPDF": {"FileID": "F1", "FileContent": "JVBERi0xLjQ=", "FileName": "INV-7.pdf"},
+}
+
+
+def test_billit_order_fields_and_pdf():
+    order = billit.BillitOrder.from_dict(ORDER)
+    assert (order.order_id, order.order_number) == (7, "INV-7")
+    assert order.pdf_bytes() == b"%PDF-1.4"
+    assert order.pdf["FileContent"] == "JVBERi0xLjQ="
+    assert order.to_dict() == ORDER
+
+
+def test_billit_order_null_field_is_not_missing():
+    order = billit.BillitOrder.from_dict(ORDER)
+    assert order["Paid"] is None
+    assert order.get("Paid", "default") is None
+    assert order.paid is None
+    with pytest.raises(KeyError):
+        order["TotalIncl"]
+    assert order.get("TotalIncl", "default") == "default"
+    assert order.total_incl is None
+    assert order["Reference"] is None
+
+
+def test_billit_order_line_null_field_is_not_missing():
+    line = billit.BillitOrder.from_dict(ORDER).lines[0]
+    assert line["VATPercentage"] is None
+    assert line.vat_percentage is None
+    with pytest.raises(KeyError):
+        line["UnitPriceExcl"]
+    assert line.get("UnitPriceExcl", 0) == 0
+    assert line.to_dict() == ORDER["OrderLines"][0]
+
+
+def test_billit_order_with_null_file_content():
+    order_dict = dict(ORDER, OrderPDF={"FileContent": None, "FileName": "INV-7.pdf"})
+    order = billit.BillitOrder.from_dict(order_dict)
+    assert order.pdf_bytes() is None
+    assert order["OrderPDF"] == {"FileContent": None, "FileName": "INV-7.pdf"}
+    assert order.to_dict() == order_dict
+    assert order.order_number == "INV-7"
+
+
+def test_billit_order_pdf_is_the_order_pdf_file_content():
+    order_dict = {
+        "OrderID": 7,
+        "Comments": 'a "quoted" \\ "FileContent": "bm90IHRoaXM="',
+        "Attachments": [{"FileName": "terms.pdf", "FileContent": "dGVybXM="}],
+        "OrderPDF": {
+            "FileName": "FileContent",
+            "Meta": {"FileContent": "bWV0YQ=="},
+            "FileContent": "JVBERi0xLjQ=",
+        },
+    }
+    order = billit.BillitOrder.from_dict(order_dict)
+    assert order.pdf_bytes() == b"%PDF-1.4"
+    assert order["Attachments"] == order_dict["Attachments"]
+    assert order["Comments"] == order_dict["Comments"]
+    assert order.to_dict() == order_dict
+
+    without_pdf = dict(order_dict, OrderPDF={"FileName": "a.pdf"})
+    assert billit.BillitOrder.from_dict(without_pdf).pdf_bytes() is None
+    assert billit.BillitOrder.from_dict(without_pdf)["Attachments"] == order_dict["Attachments"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_decode_file_content_in_chunks(chunk_size):
+    raw = b'{"FileID": "F1", "FileContent" : "JVBERi0xLjQ=", "FileName": "a.pdf"}'
+    out = bytearray()
+    chunks = [raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)]
+    file_json, size = billit._decode_file_content(chunks, out.extend)
+    assert bytes(out) == b"%PDF-1.4" and size == 8
+    assert file_json == {"FileID": "F1", "FileName": "a.pdf"}
+
+
+def test_decode_file_content_null():
+    raw = b'{"FileContent": null, "FileName": "a.pdf"}'
+    with pytest.raises(billit.ExternalAPIError):
+        billit._decode_file_content([raw], bytearray().extend)
+
+
+# **********************************************************
+# PdfReadinessPoller
+# **********************************************************
+def make_poller(polls_until_pdf, **kwargs):
+    """Poller over a fake Billit where order i has its PDF from poll polls_until_pdf[i] on"""
+    polls = {}
+
+    def answer(method, url, body):
+        order_id = int(url.rsplit("/", 1)[1])
+        polls[order_id] = polls.get(order_id, 0) + 1
+        order = {"OrderID": order_id}
+        if polls[order_id] >= polls_until_pdf.get(order_id, float("inf")):
+            order["OrderPDF"] = {"FileID": f"F{order_id}"}
+        return FakeResponse(200, json.dumps(order).encode())
+
+    client = make_client(answer, max_retries=0)
+    client.pdf_wait = billit.PdfWaitEstimator(default_delay=0.01, min_delay=0)
+    kwargs = {"interval": 0.01, "max_interval": 0.02, "deadline": 5, **kwargs}
+    return billit.PdfReadinessPoller(client, **kwargs), polls
+
+
+def test_pdf_poller_resolves_when_the_pdf_is_there():
+    poller, polls = make_poller({1: 3, 2: 1})
+    done = []
+    futures = poller.watch_many([1, 2], callback=done.append)
+    assert futures[1].result(5)["OrderPDF"] == {"FileID": "F1"}
+    assert futures[2].result(5)["OrderID"] == 2
+    assert polls == {1: 3, 2: 1}
+    assert poller.watch(1) is not futures[1]  # a resolved order is watched anew
+    poller.stop()
+    assert len(done) == 2 and poller.pending() == 0
+
+
+def test_pdf_poller_deadline():
+    poller, _ = make_poller({}, deadline=0.1)
+    with pytest.raises(billit.BillitOrderPDFTimeout):
+        poller.watch(1).result(5)
+    assert poller.pending() == 0
+    poller.stop()
+
+
+def test_pdf_poller_api_error_fails_only_that_order():
+    poller, _ = make_poller({2: 2})
+    poller.client.session.answer = lambda method, url, body, answer=poller.client.session.answer: (
+        FakeResponse(200, b"null") if url.endswith("/1") else answer(method, url, body)
+    )
+    futures = poller.watch_many([1, 2])
+    with pytest.raises(billit.BillitOrderNotFound):
+        futures[1].result(5)
+    assert futures[2].result(5)["OrderID"] == 2
+    poller.stop()
+
+
+def test_pdf_poller_cancelled_future_does_not_stop_the_poller():
+    poller, polls = make_poller({}, deadline=0.2)
+    cancelled = poller.watch(1)
+    assert cancelled.cancel()
+    assert poller.pending() == 0
+    with pytest.raises(billit.BillitOrderPDFTimeout):
+        poller.watch(2).result(5)
+    assert 1 not in polls
+    poller.stop()
+
+
+def test_pdf_poller_future_cancelled_during_a_poll():
+    futures = {}
+    poller, _ = make_poller({1: 1, 2: 2})
+    answer = poller.client.session.answer
+
+    def cancel_while_polling(method, url, body):
+        if url.endswith("/1"):
+            futures[1].cancel()  # e.g. the awaiting asyncio task is cancelled
+        return answer(method, url, body)
+
+    poller.client.session.answer = cancel_while_polling
+    futures.update(poller.watch_many([1, 2]))
+    assert futures[2].result(5)["OrderID"] == 2
+    assert futures[1].cancelled()
+    poller.stop()
+
+
+def test_pdf_poller_stop_cancels_pending_orders():
+    poller, _ = make_poller({})
+    future = poller.watch(1)
+    poller.stop()
+    assert future.cancelled()
+    with pytest.raises(RuntimeError):
+        poller.watch(2)
+
+
+def test_pdf_poller_stop_without_cancel_resolves_pending_orders():
+    poller, _ = make_poller({1: 3}, deadline=0.2)
+    futures = poller.watch_many([1, 2])
+    stopper = threading.Thread(target=poller.stop, kwargs={"cancel_pending": False})
+    stopper.start()
+    stopper.join(5)
+    assert not stopper.is_alive()
+    assert futures[1].result(0)["OrderID"] == 1
+    with pytest.raises(billit.BillitOrderPDFTimeout):
+        futures[2].result(0)
+
+
+# **********************************************************
+# iter_orders / sync_orders
+# **********************************************************
+class FakeOrderList:
+    """
+    GET /v1/orders with the OData subset the client uses: $filter on LastModified ge,
+    $orderby LastModified + OrderID, $skip and $top. after_page(n) runs after page n is served.
+    """
+
+    def __init__(self, orders, after_page=None):
+        self.orders = {order["OrderID"]: dict(order) for order in orders}
+        self.after_page = after_page
+        self.pages = 0
+
+    def modify(self, order_id):
+        latest = max(order["LastModified"] for order in self.orders.values())
+        self.orders[order_id]["LastModified"] = latest[:-2] + f"{int(latest[-2:]) + 1:02d}"
+
+    def request(self, method, url, headers=None, params=None, **kwargs):
+        orders = sorted(self.orders.values(), key=lambda o: (o["LastModified"], o["OrderID"]))
+        odata_filter = params.get("$filter", "")
+        if "DateTime'" in odata_filter:
+            since = odata_filter.split("DateTime'")[1].split("'")[0]
+            orders = [order for order in orders if order["LastModified"] >= since]
+        page = orders[params["$skip"] : params["$skip"] + params["$top"]]
+        body = json.dumps({"Items": [dict(order) for order in page]}).encode()
+        self.pages += 1
+        if self.after_page:
+            self.after_page(self, self.pages)
+        return FakeResponse(200, body)
+
+
+def make_order_client(orders, after_page=None):
+    client = make_client(None)
+    client.session = FakeOrderList(orders, after_page)
+    return client
+
+
+def orders_at(*seconds):
+    return [
+        {"OrderID": order_id, "LastModified": f"2026-01-01T00:00:{second:02d}"}
+        for order_id, second in enumerate(seconds, start=1)
+    ]
+
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_iter_orders_returns_every_order_once(prefetch):
+    client = make_order_client(orders_at(*range(10)))
+    orders = list(client.iter_orders(page_size=3, prefetch=prefetch))
+    assert [order["OrderID"] for order in orders] == list(range(1, 11))
+
+
+def test_iter_orders_with_many_orders_at_one_timestamp():
+    client = make_order_client(orders_at(1, 2, 2, 2, 2, 2, 2, 2, 3, 4))
+    orders = list(client.iter_orders(page_size=3))
+    assert [order["OrderID"] for order in orders] == list(range(1, 11))
+
+
+def test_iter_orders_modified_since():
+    client = make_order_client(orders_at(*range(10)))
+    orders = list(client.iter_orders(modified_since="2026-01-01T00:00:07", page_size=2))
+    assert [order["OrderID"] for order in orders] == [8, 9, 10]
+
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_iter_orders_order_modified_during_the_run_does_not_hide_another(prefetch):
+    def modify_after_first_page(order_list, page):
+        if page == 1:
+            order_list.modify(2)  # on the page already fetched, order 4 shifts onto it
+
+    client = make_order_client(orders_at(*range(10)), modify_after_first_page)
+    ids = [order["OrderID"] for order in client.iter_orders(page_size=3, prefetch=prefetch)]
+    assert sorted(set(ids)) == list(range(1, 11))
+    assert ids[-1] == 2  # returned again with its new LastModified
+
+
+def test_sync_orders_moves_the_cursor(tmp_path):
+    client = make_order_client(orders_at(*range(10)))
+    cursor = billit.OrderSyncCursor(str(tmp_path / "cursor.json"))
+    assert len(list(client.sync_orders(cursor, page_size=4))) == 10
+    assert cursor.load() == "2026-01-01T00:00:09"
+    # orders modified exactly at the mark are returned again
+    assert [order["OrderID"] for order in client.sync_orders(cursor, page_size=4)] == [10]
+
+    client.session.modify(3)
+    assert [order["OrderID"] for order in client.sync_orders(cursor, page_size=4)] == [10, 3]
+    assert cursor.load() == "2026-01-01T00:00:10"
+
+
+def test_sync_orders_interrupted_run_keeps_the_cursor(tmp_path):
+    client = make_order_client(orders_at(*range(10)))
+    cursor = billit.OrderSyncCursor(str(tmp_path / "cursor.json"))
+    orders = client.sync_orders(cursor, page_size=4)
+    next(orders)
+    orders.close()
+    assert cursor.load() is None
+
+
+def test_sync_orders_does_not_lose_an_order_modified_during_the_run(tmp_path):
+    def modify_after_first_page(order_list, page):
+        if page == 1:
+            order_list.modify(2)
+
+    client = make_order_client(orders_at(*range(10)), modify_after_first_page)
+    cursor = billit.OrderSyncCursor(str(tmp_path / "cursor.json"))
+    ids = {order["OrderID"] for order in client.sync_orders(cursor, page_size=3)}
+    assert ids == set(range(1, 11))
+
+
+# **********************************************************
+# fetch_order_with_pdf
+# **********************************************************
+class FakeClock:
+    """time.monotonic / time.sleep on a virtual clock, records the sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+def make_pdf_client(monkeypatch, pdf_from_poll=None):
+    clock = FakeClock()
+    monkeypatch.setattr(billit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(billit.time, "sleep", clock.sleep)
+    polls = []
+
+    def answer(method, url, body):
+        polls.append(clock.now)
+        order = {"OrderID": 7}
+        if pdf_from_poll is not None and len(polls) >= pdf_from_poll:
+            order["OrderPDF"] = {"FileID": "F7"}
+        return FakeResponse(200, json.dumps(order).encode())
+
+    return make_client(answer), clock, polls
+
+
+def test_fetch_order_with_pdf_backs_off_up_to_max_interval(monkeypatch):
+    client, clock, polls = make_pdf_client(monkeypatch, pdf_from_poll=5)
+    order = client.fetch_order_with_pdf(
+        7, delay=1, interval=2, backoff=1.5, max_interval=3, jitter=0, deadline=60
+    )
+    assert order["OrderPDF"] == {"FileID": "F7"}
+    assert clock.sleeps == [1, 2, 3, 3, 3]
+    assert len(polls) == 5
+
+
+def test_fetch_order_with_pdf_deadline(monkeypatch):
+    client, clock, polls = make_pdf_client(monkeypatch)
+    with pytest.raises(billit.BillitOrderPDFTimeout):
+        client.fetch_order_with_pdf(
+            7, max_retries=10, delay=1, interval=2, backoff=2, jitter=0, deadline=5
+        )
+    # the last wait is cut to the deadline, no poll is started after it
+    assert clock.sleeps == [1, 2, 2]
+    assert sum(clock.sleeps) == 5
+    assert len(polls) == 3
+
+
+def test_fetch_order_with_pdf_max_retries(monkeypatch):
+    client, clock, polls = make_pdf_client(monkeypatch)
+    with pytest.raises(billit.BillitOrderPDFTimeout):
+        client.fetch_order_with_pdf(7, max_retries=2, delay=0, interval=1, jitter=0, deadline=600)
+    assert len(polls) == 3
+
+
+def test_fetch_order_with_pdf_jitter_stays_within_bounds(monkeypatch):
+    client, clock, polls = make_pdf_client(monkeypatch, pdf_from_poll=3)
+    monkeypatch.setattr(billit.random, "uniform", lambda low, high: high)
+    client.fetch_order_with_pdf(7, delay=10, interval=2, backoff=1, jitter=0.2, deadline=60)
+    assert clock.sleeps == [12, 2.4, 2.4]
+
+
+def test_fetch_order_with_pdf_learns_the_first_delay(monkeypatch):
+    client, clock, polls = make_pdf_client(monkeypatch, pdf_from_poll=2)
+    client.pdf_wait = billit.PdfWaitEstimator(default_delay=5, min_delay=0.5, max_delay=15)
+    client.fetch_order_with_pdf(7, interval=2, jitter=0, deadline=60)
+    assert clock.sleeps == [5, 2]
+    # found at 7s, missed at 5s: the next order waits 6s before its first poll
+    assert client.pdf_wait.initial_delay() == 6
+    clock.sleeps.clear()
+    client.fetch_order_with_pdf(7, interval=2, jitter=0, deadline=60)
+    assert clock.sleeps[0] == 6
@@ -0,0 +1,335 @@
+"""
+Tests for my_helpers.data_processing_utils.data_procesing_utils_v2
+The v2 cleaners must give the same output as the v1 cleaners they replace
+"""
+
+import contextlib
+import io
+import json
+import random
+
+import pytest
+
+from my_helpers.data_processing_utils import data_procesing_utils_v1 as v1
+from my_helpers.data_processing_utils import data_procesing_utils_v2 as v2
+
+LEAVES = [
+    "€1,752.66",
+    "1.234,50 €",
+    "21%",
+    "6.5%",
+    "05/17/2023",
+    "17-05-2023",
+    "2023-05-17",
+    "hello world",
+    'quote " and \\ backslash',
+    "Kerkstraat 12, 2000 Antwerpen",
+    "12",
+    "12.5",
+    "1,000",
+    "",
+    None,
+    3,
+    2.5,
+    -0.001,
+    True,
+    False,
+    10**40,
+    1.5e300,
+    "abc12",
+    " 42 ",
+    "13/13/2023",
+    "€ 12",
+    "٣",
+    "ünïcödé ✓",
+]
+KEYS = ["name", "line items", "a", "vat rate", "", "Order date", "order Date", "Total €"]
+
+
+def random_document(rng, depth=0):
+    r = rng.random()
+    if depth < 4 and r < 0.3:
+        return {
+            rng.choice(KEYS): random_document(rng, depth + 1)
+            for _ in range(rng.randint(0, 5))
+        }
+    if depth < 4 and r < 0.5:
+        return [random_document(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return rng.choice(LEAVES)
+
+
+def v1_clean_json_data(data):
+    # v1 prints the document between the steps
+    with contextlib.redirect_stdout(io.StringIO()):
+        return v1.clean_json_data(data)
+
+
+DOCUMENTS = [random_document(random.Random(seed)) for seed in range(300)]
+
+
+# **********************************************************
+# compile_cleaning_pipeline / clean_json_data against v1
+# **********************************************************
+def test_compile_cleaning_pipeline_matches_v1_clean_json_data():
+    clean = v2.compile_cleaning_pipeline(
+        v2.CLEAN_JSON_KEY_TRANSFORMS, v2.CLEAN_JSON_VALUE_TRANSFORMS
+    )
+    for document in DOCUMENTS:
+        expected = v1_clean_json_data(json.loads(json.dumps(document)))
+        assert repr(clean(document)) == repr(expected)
+
+
+@pytest.mark.parametrize(
+    "v1_cleaner, v2_cleaner",
+    [
+        (v1.capitalize_keys, v2.capitalize_keys),
+        (v1.clean_money_in_json, v2.clean_money_in_json),
+        (v1.clean_money_in_json_2, v2.clean_money_in_json_2),
+        (v1.clean_vat_in_json, v2.clean_vat_in_json),
+        (v1.normalize_keys, v2.normalize_keys),
+        (v1.convert_numeric_strings, v2.convert_numeric_strings),
+    ],
+)
+def test_single_cleaners_match_v1(v1_cleaner, v2_cleaner):
+    for document in DOCUMENTS:
+        expected = v1_cleaner(json.loads(json.dumps(document)))
+        assert repr(v2_cleaner(document)) == repr(expected)
+
+
+@pytest.mark.parametrize("mode", [{"inplace": True}, {"share": True}])
+def test_clean_json_data_modes_match_the_copy(mode):
+    for document in DOCUMENTS:
+        expected = v2.clean_json_data(document)
+        copy = json.loads(json.dumps(document))
+        assert repr(v2.clean_json_data(copy, **mode)) == repr(expected)
+
+
+# **********************************************************
+# Streaming parser
+# **********************************************************
+@pytest.mark.parametrize(
+    "document, chunk_size",
+    [
+        ("[" + "1" * 40 + "]", 7),
+        ("[1." + "5" * 50 + "]", 16),
+        ('{"a": ' + "9" * 100 + "}", 64),
+        ("[-" + "1" * 70 + "e-5, true, false, null]", 3),
+        ("123", 1),
+    ],
+)
+def test_iter_json_events_numbers_across_chunks(document, chunk_size):
+    events = list(v2.iter_json_events(io.StringIO(document), chunk_size=chunk_size))
+    values = [value for event, value in events if event == "value"]
+    expected = json.loads(document)
+    if isinstance(expected, dict):
+        expected = list(expected.values())
+    elif not isinstance(expected, list):
+        expected = [expected]
+    assert values == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000, 65536])
+def test_iter_json_items_long_strings_across_chunks(chunk_size):
+    documents = [
+        {"FileContent": "QUJD" * 50_000, "FileName": "a.pdf"},
+        {"Text": 'escaped \\ " \n \u00e9 ✓ ' * 5_000},
+        ["x" * 100_000, "", "y"],
+    ]
+    source = io.StringIO(json.dumps(documents))
+    assert list(v2.iter_json_items(source, chunk_size=chunk_size)) == documents
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 16, 64, 65536])
+def test_clean_json_stream_matches_clean_json_data(chunk_size):
+    for document in DOCUMENTS[:100]:
+        text = json.dumps(document, ensure_ascii=chunk_size % 2 == 0)
+        out = io.StringIO()
+        v2.clean_json_stream(io.StringIO(text), out, chunk_size=chunk_size)
+        assert json.loads(out.getvalue()) == v2.clean_json_data(json.loads(text))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64])
+def test_iter_json_items_matches_json_loads(chunk_size):
+    documents = DOCUMENTS[:50]
+    source = io.BytesIO(json.dumps(documents).encode())
+    assert list(v2.iter_json_items(source, chunk_size=chunk_size)) == documents
+
+
+@pytest.mark.parametrize("document", ["[1,]", "[1 2]", '{"a" 1}', "[tru]", "{"])
+def test_iter_json_events_rejects_invalid_json(document):
+    with pytest.raises(ValueError):
+        list(v2.iter_json_events(io.StringIO(document), chunk_size=2))
+
+
+# **********************************************************
+# Columnar cleaner
+# **********************************************************
+def row_by_row(rows):
+    clean = v2.compile_cleaning_pipeline(
+        v2.CLEAN_JSON_KEY_TRANSFORMS, v2.CLEAN_JSON_VALUE_TRANSFORMS
+    )
+    return [clean(row) for row in rows]
+
+
+def test_clean_rows_columnar_matches_row_by_row():
+    rng = random.Random(0)
+    rows = [
+        {key: rng.choice(LEAVES) for key in ["Price", "vat rate", "quantity", "Order date"]}
+        for _ in range(500)
+    ]
+    # enough distinct strings per column for the NumPy path
+    for i, row in enumerate(rows):
+        row["Price"] = f"€{i},{i % 100:02d}"
+        row["quantity"] = f"{i}.{i % 7}"
+    assert repr(v2.clean_rows_columnar(rows)) == repr(row_by_row(rows))
+
+
+@pytest.mark.parametrize("value", ["8\x00", "943\x00.", "\x00", "1\x00%"])
+def test_clean_rows_columnar_keeps_nul_characters(value):
+    rows = [{"price": f"€{i}", "vat": f"{i}%", "amount": f"{i}.5"} for i in range(100)]
+    rows[10] = {"price": value, "vat": value, "amount": value}
+    assert repr(v2.clean_rows_columnar(rows)) == repr(row_by_row(rows))
+
+
+def test_clean_rows_columnar_keeps_distinct_values_apart():
+    rows = [{"a": value} for value in [0.0, -0.0, 0, False, 1, 1.0, True, -0.0, "0"]]
+    assert repr(v2.clean_rows_columnar(rows)) == repr(row_by_row(rows))
+
+
+# **********************************************************
+# Address parsing
+# **********************************************************
+ADDRESSES = [
+    "Kerkstraat 12, box 3, 2000 Antwerpen, Belgium",
+    "Kerkstraat 12-3, 2000 Antwerpen",
+    "Kerkstraat 12 - 3 , 2000 Antwerpen , Belgium",
+    "  Rue de la Loi 16 ,  BOX 2,1000 Brussel,BE",
+    "Rue de la Loi 16, box 1, box 2, 1000 Brussel, BE",
+    "Main Street, 1000 Brussels",
+    "Grote Markt 1, Gebouw B, 9000 Gent, Belgium, EU",
+    "Kerkstraat 12, 2000",
+]
+
+
+def test_parse_address():
+    assert v2.parse_address("Kerkstraat 12, box 3, 2000 Antwerpen, Belgium") == {
+        "streetname": "Kerkstraat",
+        "streetnumber": "12",
+        "box": "3",
+        "postalzone": "2000",
+        "city": "Antwerpen",
+        "country": "Belgium",
+    }
+    hyphen_box = v2.parse_address("Kerkstraat 12-3, 2000 Antwerpen")
+    assert (hyphen_box["streetnumber"], hyphen_box["box"], hyphen_box["country"]) == ("12", "3", "")
+
+
+@pytest.mark.parametrize("address_type", ["supplier", "customer"])
+def test_split_address_advanced_matches_v1(address_type):
+    for address in ADDRESSES:
+        expected = v1.split_address_advanced(address, address_type)
+        assert v2.split_address_advanced(address, address_type) == expected
+        parsed = v2.parse_address(address)
+        prefix = f"P_{address_type}_address_"
+        assert {prefix + field: value for field, value in parsed.items()} == expected
+
+
+def test_parse_addresses_returns_independent_results():
+    results = v2.parse_addresses(ADDRESSES * 3)
+    assert results == [v2.parse_address(address) for address in ADDRESSES] * 3
+    results[0]["city"] = "changed"
+    assert v2.parse_addresses(ADDRESSES[:1])[0]["city"] == "Antwerpen"
+
+
+@pytest.mark.parametrize("address", ["Kerkstraat 12 2000 Antwerpen", ""])
+def test_parse_address_invalid(address):
+    with pytest.raises(ValueError):
+        v2.parse_address(address)
+    with pytest.raises(ValueError):
+        v1.split_address_advanced(address, "customer")
+
+
+def test_split_address_advanced_invalid_type():
+    with pytest.raises(ValueError):
+        v2.split_address_advanced(ADDRESSES[0], "employee")
+
+
+# **********************************************************
+# compile_mapping
+# **********************************************************
+ORDER = {
+    "OrderNumber": "INV-7",
+    "TotalIncl": "121.00",
+    "Customer": {"Name": "Acme", "Addresses": [{"City": "Gent"}, {"City": "Antwerpen"}]},
+    "OrderLines": [{"Description": "Coffee"}],
+}
+
+
+def test_compile_mapping_nested_paths_and_outputs():
+    mapper = v2.compile_mapping(
+        {
+            "OrderNumber": "order_number",
+            "TotalIncl": ("total", float),
+            ("Customer", "Name"): ("customer", "name"),
+            ("Customer", "Addresses", -1, "City"): {"to": ("customer", "city"), "transform": str.upper},
+            ("OrderLines", 0, "Description"): "first_line",
+        }
+    )
+    assert mapper(ORDER) == {
+        "order_number": "INV-7",
+        "total": 121.0,
+        "customer": {"name": "Acme", "city": "ANTWERPEN"},
+        "first_line": "Coffee",
+    }
+    assert not mapper.missing
+
+
+def test_compile_mapping_defaults_and_missing_keys():
+    mapper = v2.compile_mapping(
+        {
+            "Currency": ("currency", None, "EUR"),
+            "Paid": {"to": "paid", "transform": bool, "default": False},
+            ("Customer", "VATNumber"): "vat_number",
+            ("Customer", "Addresses", 5, "City"): "city",
+            ("OrderNumber", "x"): "broken_path",
+        }
+    )
+    assert mapper(ORDER) == {"currency": "EUR", "paid": False}
+    assert mapper({"Currency": "USD", "Paid": 1}) == {"currency": "USD", "paid": True}
+    assert mapper.missing == {
+        "Customer.VATNumber": 2,
+        "Customer.Addresses.5.City": 2,
+        "OrderNumber.x": 2,
+    }
+
+
+def test_compile_mapping_map_many_and_report_missing(caplog):
+    mapper = v2.compile_mapping({"OrderNumber": "number", "Reference": "reference"})
+    inputs = [ORDER, {"OrderNumber": "INV-8", "Reference": "PO-1"}, {}]
+    assert mapper.map_many(inputs) == [
+        {"number": "INV-7"},
+        {"number": "INV-8", "reference": "PO-1"},
+        {},
+    ]
+    with caplog.at_level("WARNING"):
+        assert mapper.report_missing(reset=False) == {"Reference": 2, "OrderNumber": 1}
+    assert "'Reference' (2x)" in caplog.text
+    assert mapper.report_missing() == {"Reference": 2, "OrderNumber": 1}
+    assert mapper.report_missing() == {}
+
+
+@pytest.mark.parametrize("rule", [("a", str, None, 1), ()])
+def test_compile_mapping_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        v2.compile_mapping({"key": rule})
+    with pytest.raises(ValueError):
+        v2.compile_mapping({(): "out"})
+
+
+def test_map_json_matches_v1():
+    rules = {"OrderNumber": "number", "TotalIncl": ("total", float), "Missing": "missing"}
+    with contextlib.redirect_stdout(io.StringIO()) as v1_out:
+        expected = v1.map_json(ORDER, rules)
+    with contextlib.redirect_stdout(io.StringIO()) as v2_out:
+        assert v2.map_json(ORDER, rules) == expected
+    assert "'Missing'" in v1_out.getvalue() and "'Missing'" in v2_out.getvalue()
@@ -0,0 +1,266 @@
+"""
+Tests for my_helpers.webhook_utils.webhook_utils_v7
+AppSheet is replaced by a fake requests session, no network calls are made
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from my_helpers.webhook_utils import webhook_utils_v7 as webhook
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeAppSheet:
+    """A table with a version number, Finds return the version, writes increase it"""
+
+    def __init__(self):
+        self.version = 0
+        self.calls = []
+        self.find_started = threading.Event()
+        self.release_find = threading.Event()
+        self.release_find.set()
+
+    def post(self, url, json=None, timeout=None):
+        self.calls.append(json["Action"])
+        if json["Action"] == "Find":
+            version = self.version
+            self.find_started.set()
+            self.release_find.wait(5)
+            return FakeResponse({"Rows": [{"Version": version}]})
+        self.version += 1
+        return FakeResponse({"Rows": json["Rows"]})
+
+
+def make_client(find_cache=None):
+    client = webhook.AppSheetClient("APP", "KEY", find_cache=find_cache)
+    client.session = FakeAppSheet()
+    return client
+
+
+def find(client):
+    return client.post("Products", [], "Find", selector="Filter(Products, true)").json()
+
+
+# **********************************************************
+# SingleFlight
+# **********************************************************
+def test_single_flight_runs_once_for_concurrent_callers():
+    flight = webhook.SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "result"
+
+    with ThreadPoolExecutor(8) as executor:
+        leader = executor.submit(flight.do, "key", slow)
+        started.wait(5)
+        followers = [executor.submit(flight.do, "key", slow) for _ in range(7)]
+        results = [leader.result()] + [future.result() for future in followers]
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["result"] * 8
+    assert [is_leader for _, is_leader in results] == [True] + [False] * 7
+
+
+def test_single_flight_shares_the_exception_and_forgets_the_key():
+    flight = webhook.SingleFlight()
+
+    def fail():
+        raise webhook.ExternalAPIError("down")
+
+    with pytest.raises(webhook.ExternalAPIError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: "again") == ("again", True)
+
+
+# **********************************************************
+# AppSheetFindCache
+# **********************************************************
+def test_find_cache_ttl_and_lru():
+    cache = webhook.AppSheetFindCache(max_items=2, ttl=0.1)
+    keys = [cache.key("APP", "T", f"selector {i}") for i in range(3)]
+    for key in keys:
+        cache.put(key, b"{}", cache.generation("APP", "T"))
+    assert cache.get(keys[0]) is None  # evicted
+    assert cache.get(keys[2]) == b"{}"
+    time.sleep(0.15)
+    assert cache.get(keys[2]) is None  # expired
+
+
+def test_find_cache_invalidation_and_stale_put():
+    cache = webhook.AppSheetFindCache()
+    key = cache.key("APP", "T", None, [], None)
+    other = cache.key("APP", "Other", None, [], None)
+    generation = cache.generation("APP", "T")
+    cache.put(key, b"old", generation)
+    cache.put(other, b"other", cache.generation("APP", "Other"))
+
+    cache.invalidate_table("APP", "T")
+    assert cache.get(key) is None
+    assert cache.get(other) == b"other"
+
+    # a Find that started before the write may not cache its answer
+    cache.put(key, b"stale", generation)
+    assert cache.get(key) is None
+
+
+def test_client_serves_cached_find_and_invalidates_on_write():
+    client = make_client(webhook.AppSheetFindCache())
+    assert find(client) == find(client)
+    assert client.session.calls == ["Find"]
+
+    client.post("Products", [{"Name": "new"}], "Add")
+    assert find(client)["Rows"][0]["Version"] == 1
+    assert client.session.calls == ["Find", "Add", "Find"]
+
+
+def test_find_started_before_a_write_is_not_joined_nor_cached():
+    client = make_client(webhook.AppSheetFindCache())
+    appsheet = client.session
+    appsheet.release_find.clear()
+
+    with ThreadPoolExecutor(2) as executor:
+        # a Find starts and hangs in AppSheet, it reads the table before the write
+        before_write = executor.submit(find, client)
+        assert appsheet.find_started.wait(5)
+        client.post("Products", [{"Name": "new"}], "Add")
+        # an identical Find after the write must not share the old call
+        after_write = executor.submit(find, client)
+        time.sleep(0.1)
+        appsheet.release_find.set()
+
+        assert before_write.result()["Rows"][0]["Version"] == 0
+        assert after_write.result()["Rows"][0]["Version"] == 1
+
+    # the cache holds the answer from after the write
+    calls = len(appsheet.calls)
+    assert find(client)["Rows"][0]["Version"] == 1
+    assert len(appsheet.calls) == calls
+
+
+def test_identical_concurrent_finds_share_one_call():
+    client = make_client()
+    appsheet = client.session
+    appsheet.release_find.clear()
+
+    with ThreadPoolExecutor(10) as executor:
+        futures = [executor.submit(find, client) for _ in range(10)]
+        appsheet.find_started.wait(5)
+        time.sleep(0.1)
+        appsheet.release_find.set()
+        results = [future.result() for future in futures]
+
+    assert appsheet.calls == ["Find"]
+    assert all(result == results[0] for result in results)
+
+
+# **********************************************************
+# post_data_to_appsheet_bulk
+# **********************************************************
+class FakeBulkAppSheet:
+    """Answers every post with answer(rows), records the rows of every post"""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        rows = json["Rows"]
+        with self.lock:
+            self.posts.append([row["Id"] for row in rows])
+        result = self.answer(rows)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def post_bulk(monkeypatch, answer, rows, **kwargs):
+    client = webhook.AppSheetClient("APP", "KEY")
+    client.session = FakeBulkAppSheet(answer)
+    monkeypatch.setattr(webhook, "get_appsheet_client", lambda app_id, key: client)
+    monkeypatch.setattr(webhook.time, "sleep", lambda seconds: None)
+    kwargs = {"chunk_rows": 3, "concurrency": 4, **kwargs}
+    try:
+        return webhook.post_data_to_appsheet_bulk(
+            "Products", rows, "Add", app_name="App", app_id="APP", app_access_key="KEY", **kwargs
+        ), client.session
+    except webhook.ExternalAPIError as e:
+        return e, client.session
+
+
+def echo(rows):
+    return FakeResponse({"Rows": rows})
+
+
+ROWS = [{"Id": i, "Name": f"product {i}"} for i in range(10)]
+
+
+def test_split_rows_in_chunks():
+    assert [len(c) for c in webhook.split_rows_in_chunks(ROWS, chunk_rows=4)] == [4, 4, 2]
+    row_size = len(json.dumps(ROWS[0]).encode()) + 1
+    chunks = webhook.split_rows_in_chunks(ROWS, chunk_rows=100, chunk_bytes=2 * row_size)
+    assert [len(c) for c in chunks] == [2] * 5
+    big = {"Id": 99, "Name": "x" * 1000}
+    assert webhook.split_rows_in_chunks([big, ROWS[0]], chunk_bytes=100) == [[big], [ROWS[0]]]
+
+
+def test_bulk_posts_chunks_and_keeps_the_row_order(monkeypatch):
+    def slow_first_chunk(rows):
+        if rows[0]["Id"] == 0:
+            threading.Event().wait(0.1)  # the first chunk finishes last (time.sleep is patched)
+        return echo(rows)
+
+    result, appsheet = post_bulk(monkeypatch, slow_first_chunk, ROWS)
+    assert result == ROWS
+    assert sorted(appsheet.posts) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_bulk_retries_a_rejected_chunk(monkeypatch):
+    rejected = []
+
+    def reject_once(rows):
+        if rows[0]["Id"] == 3 and not rejected:
+            rejected.append(1)
+            return FakeResponse({"error": "busy"}, status_code=500)
+        return echo(rows)
+
+    result, appsheet = post_bulk(monkeypatch, reject_once, ROWS)
+    assert result == ROWS
+    assert appsheet.posts.count([3, 4, 5]) == 2
+
+
+def test_bulk_partial_failure(monkeypatch):
+    def answer(rows):
+        if rows[0]["Id"] == 3:
+            return FakeResponse({"error": "bad row"}, status_code=400)
+        if rows[0]["Id"] == 6:
+            return requests.exceptions.ReadTimeout("read timed out")
+        return echo(rows)
+
+    error, appsheet = post_bulk(monkeypatch, answer, ROWS, chunk_retries=2, max_retries=3)
+    assert isinstance(error, webhook.ExternalAPIError)
+    assert error.rows == ROWS[:3] + ROWS[9:]
+    assert error.failed_rows == ROWS[3:6]  # rejected: not written
+    assert error.unknown_rows == ROWS[6:9]  # no answer: may have been written
+    assert appsheet.posts.count([3, 4, 5]) == 3  # 1 + chunk_retries
+    # the timed-out chunk is only retried by the client's own retries, never as a chunk again
+    assert appsheet.posts.count([6, 7, 8]) == 3